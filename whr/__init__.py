@@ -0,0 +1,22 @@
+"""
+Shared helpers for the World Happiness Report (WHR) exercises.
+"""
+
+from .binning import BinnedTotals, Bins, StreamingQcut, qcut_csv
+from .correlation import (OnlineCorrelation, bootstrap_corr, pairwise_corr,
+                          rolling_corr)
+from .grouping import GroupIndex
+from .loader import (COLS_TO_INCLUDE, EXPLANATORY_VARS, RENAMING, WHR_FILE,
+                     compact_dtypes, load_country_means, load_whr,
+                     load_whr_sheets, memory_savings, read_sheets)
+from .olap import OLAPCube
+from .panel import PanelCube, load_panel
+from .plotting import (PairHistograms, pairplot_density, render_facets,
+                       save_facets, stitch_tiles)
+from .regression import (OLSResult, StreamingOLS, all_subsets_ols,
+                         elastic_net_path, fit_ols, fixed_effects_ols,
+                         grouped_ols, ols_csv, ols_csvs, ridge_path)
+from .store import DystopiaCache, WHRStore, dystopia_benchmarks
+from .sketch import KLLSketch
+from .summary import (SummaryState, produce_summary_table,
+                      produce_summary_tables, summarize_csv, summarize_csvs)
@@ -0,0 +1,855 @@
+"""
+Benchmarks for the WHR helpers.
+
+Run a benchmark from the repository root with, for example,
+
+    python -m whr.benchmarks load --path WHR2018Chapter2OnlineData.xls
+
+Each benchmark prints its timings and returns them as a dictionary.
+"""
+
+import argparse
+import copy
+import inspect
+import io
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+from itertools import combinations
+
+import numpy as np
+import pandas as pd
+
+from .binning import BinnedTotals, Bins, StreamingQcut
+from .correlation import bootstrap_corr, pairwise_corr, rolling_corr
+from .grouping import GroupIndex
+from .loader import (COLS_TO_INCLUDE, EXPLANATORY_VARS, RENAMING, WHR_FILE,
+                     load_country_means, load_whr, memory_savings,
+                     read_sheets)
+from .olap import OLAPCube
+from .panel import PanelCube, load_panel
+from .plotting import (PairHistograms, pairplot_density, render_facets,
+                       stitch_tiles)
+from .regression import (all_subsets_ols, fit_ols, fixed_effects_ols,
+                         grouped_ols, ridge_path)
+from .store import DystopiaCache, WHRStore, dystopia_benchmarks
+from .summary import produce_summary_table, produce_summary_tables
+
+
+INDICATORS = [RENAMING.get(name, name) for name in COLS_TO_INCLUDE
+              if name not in ('country', 'year')]
+
+
+def synthetic_panel(n_rows=10**6, n_years=13, first_year=2005,
+                    n_indicators=len(INDICATORS), missing=0.05, seed=0):
+    """
+    Returns a synthetic long-format panel shaped like the WHR dataframe df:
+    n_rows country-years over n_years consecutive years, with a categorical
+    country column and n_indicators columns of which a fraction missing of
+    the values are NaN.
+    """
+    rng = np.random.default_rng(seed)
+    n_countries = -(-n_rows // n_years)
+    names = INDICATORS + ['X{}'.format(k) for k in range(len(INDICATORS),
+                                                         n_indicators)]
+    values = rng.normal(size=(n_rows, n_indicators))
+    values[rng.random(values.shape) < missing] = np.nan
+    df = pd.DataFrame(values, columns=names[:n_indicators])
+    codes = np.repeat(np.arange(n_countries), n_years)[:n_rows]
+    labels = ['Country {:06d}'.format(i) for i in range(n_countries)]
+    df.insert(0, 'country', pd.Categorical.from_codes(codes, labels))
+    years = np.arange(first_year, first_year + n_years)
+    df.insert(1, 'year', np.tile(years, n_countries)[:n_rows])
+    return df
+
+
+def _best_time(func, repeat=5):
+    """
+    Returns the best wall-clock time in seconds of repeat calls to func.
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def _report(title, timings):
+    print(title)
+    for name, seconds in timings.items():
+        print('  {:<40s} {:12.3f} ms'.format(name, 1000 * seconds))
+    return timings
+
+
+def bench_load(path=WHR_FILE, repeat=5):
+    """
+    Compares pd.read_excel with cold (parse and store) and warm (cached)
+    calls to load_whr.
+    """
+    cache_dir = tempfile.mkdtemp(prefix='whr-bench-')
+    try:
+        timings = {
+            'pd.read_excel': _best_time(
+                lambda: pd.read_excel(path, sheet_name='Table2.1'), repeat),
+            'load_whr (cold)': _best_time(
+                lambda: load_whr(path, cache_dir=cache_dir, refresh=True),
+                repeat),
+            'load_whr (warm)': _best_time(
+                lambda: load_whr(path, cache_dir=cache_dir), repeat),
+        }
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+    return _report('Loading Table2.1 from ' + path, timings)
+
+
+def bench_projection(path=WHR_FILE, repeat=5):
+    """
+    Compares building df from the full dfraw, as the exercises do, with
+    loading only cols_to_include through load_whr, and reports the memory
+    saved by the compact dtypes.
+    """
+    cache_dir = tempfile.mkdtemp(prefix='whr-bench-')
+    try:
+        def full():
+            dfraw = load_whr(path, cache_dir=cache_dir)
+            return dfraw[COLS_TO_INCLUDE].rename(RENAMING, axis=1)
+
+        def projected():
+            return load_whr(path, cache_dir=cache_dir,
+                            columns=COLS_TO_INCLUDE, renaming=RENAMING,
+                            compact=True)
+
+        full()
+        projected()
+        timings = {
+            'dfraw[cols].rename (warm)': _best_time(full, repeat),
+            'load_whr(columns=...) (warm)': _best_time(projected, repeat),
+        }
+        dfraw = load_whr(path, cache_dir=cache_dir)
+        savings = memory_savings(projected(), dfraw)
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+    _report('Projected and compact loading of Table2.1', timings)
+    print('  memory: dfraw {:,.0f} bytes, df {:,.0f} bytes, {:.0%} saved'
+          .format(savings['dfraw'], savings['df'], savings['fraction saved']))
+    return timings
+
+
+def bench_sheets(path=WHR_FILE, repeat=5):
+    """
+    Compares reading Table2.1 and SupportingFactors with two read_excel
+    calls against read_sheets, and times building df2 cold and warm.
+    """
+    sheet_names = ['Table2.1', 'SupportingFactors']
+    cache_dir = tempfile.mkdtemp(prefix='whr-bench-')
+    try:
+        timings = {
+            'pd.read_excel x 2': _best_time(
+                lambda: [pd.read_excel(path, sheet_name=name)
+                         for name in sheet_names], repeat),
+            'read_sheets': _best_time(
+                lambda: read_sheets(path, sheet_names), repeat),
+            'load_country_means (cold)': _best_time(
+                lambda: load_country_means(path, cache_dir, refresh=True),
+                repeat),
+            'load_country_means (warm)': _best_time(
+                lambda: load_country_means(path, cache_dir), repeat),
+        }
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+    return _report('Reading Table2.1 and SupportingFactors', timings)
+
+
+def bench_panel(path=WHR_FILE, repeat=20):
+    """
+    Compares selecting the 2015-2017 window (df1517) and the summary
+    windows of the exercises with boolean masks on df against slicing the
+    memory-mapped PanelCube.
+    """
+    cache_dir = tempfile.mkdtemp(prefix='whr-bench-')
+    windows = [(2005, 2007), (2008, 2010), (2015, 2017)]
+    try:
+        df = load_whr(path, cache_dir=cache_dir, columns=COLS_TO_INCLUDE,
+                      renaming=RENAMING)
+        cube = load_panel(path, cache_dir)
+        indicators = cube.indicators
+
+        def masked_means():
+            return [df.loc[(df['year'] >= start) & (df['year'] <= stop),
+                           indicators].mean() for start, stop in windows]
+
+        def cube_means():
+            return [np.nanmean(cube.window(start, stop), axis=(0, 1))
+                    for start, stop in windows]
+
+        timings = {
+            'df1517 (isin mask)': _best_time(
+                lambda: df[df.year.isin(range(2015, 2018))], repeat),
+            'df1517 (cube window)': _best_time(
+                lambda: cube.window(2015, 2017), repeat),
+            'window means (masks)': _best_time(masked_means, repeat),
+            'window means (cube)': _best_time(cube_means, repeat),
+        }
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+    return _report('Year windows of the WHR panel', timings)
+
+
+def bench_corr(n_rows=2000, widths=(10, 50, 100, 500), repeat=3):
+    """
+    Compares DataFrame.corr with pairwise_corr on synthetic data with 20%
+    missing values, for an increasing number of columns.  Kendall's tau is
+    only timed up to 50 columns, where pandas is already slow.
+    """
+    timings = {}
+    for width in widths:
+        df = synthetic_panel(n_rows, n_indicators=width, missing=0.2)
+        df = df.drop(columns=['country', 'year'])
+        methods = ['pearson', 'spearman']
+        if width <= 50:
+            methods.append('kendall')
+        for method in methods:
+            for name, func in (('DataFrame.corr', df.corr),
+                               ('pairwise_corr', lambda **kwargs:
+                                pairwise_corr(df, **kwargs))):
+                label = '{} {} ({} cols)'.format(name, method, width)
+                timings[label] = _best_time(lambda: func(method=method),
+                                            repeat)
+    return _report('Pairwise-complete correlations of {:,} rows'.format(
+        n_rows), timings)
+
+
+def bench_binning(n_rows=10**7, chunksize=10**6, repeat=3):
+    """
+    Compares the group-bys by bins of the GroupingCuts exercise (the means
+    by bins of Happiness, and the sizes of 10 bins and of the quartiles of
+    LogGDP) done with pd.cut and pd.qcut with the same results from Bins
+    compiled once, over the whole frame and over chunks of it.
+    """
+    df = synthetic_panel(n_rows)
+    df['Happiness'] = df['Happiness'] + 5
+    numeric = df.drop(columns=['country'])
+
+    def pandas_cuts():
+        return (numeric.groupby(pd.cut(df.Happiness,
+                                       bins=list(range(0, 11)))).mean(),
+                df.groupby(pd.cut(df.LogGDP, bins=10)).size(),
+                df.groupby(pd.qcut(df.LogGDP, q=4)).size())
+
+    happiness = Bins.cut(df.Happiness, bins=list(range(0, 11)))
+    deciles = Bins.cut(df.LogGDP, bins=10)
+    quartiles = Bins.qcut(df.LogGDP, q=4)
+
+    def compiled():
+        return (happiness.mean(df, 'Happiness'), deciles.counts(df.LogGDP),
+                quartiles.counts(df.LogGDP))
+
+    def streamed():
+        totals = [BinnedTotals(happiness, 'Happiness'),
+                  BinnedTotals(deciles, 'LogGDP', []),
+                  BinnedTotals(quartiles, 'LogGDP', [])]
+        for start in range(0, n_rows, chunksize):
+            chunk = df.iloc[start:start + chunksize]
+            for total in totals:
+                total.update(chunk)
+        return (totals[0].mean(), totals[1].counts(), totals[2].counts())
+
+    timings = {
+        'pd.cut / pd.qcut group-bys': _best_time(pandas_cuts, repeat),
+        'Bins.cut / Bins.qcut (edges)': _best_time(
+            lambda: (Bins.cut(df.Happiness, bins=list(range(0, 11))),
+                     Bins.cut(df.LogGDP, bins=10),
+                     Bins.qcut(df.LogGDP, q=4)), repeat),
+        'Bins with compiled edges': _best_time(compiled, repeat),
+        'BinnedTotals over {:,}-row chunks'.format(chunksize): _best_time(
+            streamed, repeat),
+    }
+    return _report('Binned group-bys over {:,} rows'.format(n_rows),
+                   timings)
+
+
+def bench_bootstrap(n_rows=450, n_resamples=200, repeat=3):
+    """
+    Compares resampling countries with pandas and calling df.corr() for each
+    resample with bootstrap_corr, on a synthetic three-year panel the size
+    of df1517.
+    """
+    df = synthetic_panel(n_rows, n_years=3, first_year=2015)
+    codes, countries = pd.factorize(df['country'])
+    rows = [np.flatnonzero(codes == k) for k in range(len(countries))]
+    numeric = df.drop(columns=['country'])
+
+    def looped():
+        rng = np.random.default_rng(0)
+        samples = []
+        for _ in range(n_resamples):
+            drawn = rng.integers(len(rows), size=len(rows))
+            sample = numeric.iloc[np.concatenate([rows[k] for k in drawn])]
+            samples.append(sample.corr().to_numpy())
+        return np.nanquantile(samples, [0.025, 0.975], axis=0)
+
+    timings = {
+        'pandas resampling loop': _best_time(looped, repeat),
+        'bootstrap_corr': _best_time(
+            lambda: bootstrap_corr(df, n_resamples=n_resamples), repeat),
+        'bootstrap_corr (x10 resamples)': _best_time(
+            lambda: bootstrap_corr(df, n_resamples=10 * n_resamples),
+            repeat),
+    }
+    return _report('{} bootstrap resamples of {} countries'.format(
+        n_resamples, len(countries)), timings)
+
+
+def bench_dystopia(n_rows=10**6, n_years=60, repeat=3):
+    """
+    Compares computing the Dystopia benchmark of every rolling 3-year window
+    of a synthetic panel as the GroupingKeys exercise does for 2015-2017
+    with dystopia_benchmarks, and with a DystopiaCache that already holds
+    them.
+    """
+    df = synthetic_panel(n_rows, n_years=n_years)
+    first = df['year'].min()
+    windows = [(start, start + 2) for start in range(first,
+                                                     first + n_years - 2)]
+
+    def looped():
+        benchmarks = {}
+        for start, stop in windows:
+            window = df[df['year'].isin(range(start, stop + 1))]
+            by_country = window.groupby(['country'], observed=True)
+            min_avg_vals = by_country.mean().min()
+            max_avg_vals = by_country.mean().max()
+            dystopia = min_avg_vals.copy()
+            dystopia['Corruption'] = max_avg_vals['Corruption']
+            benchmarks[start, stop] = dystopia[EXPLANATORY_VARS]
+        return benchmarks
+
+    cube = PanelCube.from_frame(df, version=0)
+    cache = DystopiaCache()
+    cache(cube, windows)
+    timings = {
+        'groupby loop': _best_time(looped, repeat),
+        'PanelCube.from_frame': _best_time(
+            lambda: PanelCube.from_frame(df, version=0), repeat),
+        'dystopia_benchmarks': _best_time(
+            lambda: dystopia_benchmarks(cube, windows), repeat),
+        'DystopiaCache (cached)': _best_time(lambda: cache(cube, windows),
+                                             repeat),
+    }
+    return _report('Dystopia of {} windows over {:,} rows'.format(
+        len(windows), n_rows), timings)
+
+
+def bench_facets(n_countries=160, max_workers=None, repeat=1):
+    """
+    Compares the per-country bar plots of Happiness by year of the
+    PlotSummary exercise drawn as one figure by sns.catplot with the same
+    grid drawn in tiles by render_facets, both written as a PNG, on a
+    synthetic panel, and prints the sizes of the PNGs.
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    from matplotlib.image import imsave
+
+    df = synthetic_panel(13 * n_countries)
+    df['Happiness'] = df['Happiness'] + 5
+    sizes = {}
+
+    def catplot():
+        plot = sns.catplot(x='year', y='Happiness', col='country',
+                           col_wrap=3, data=df, kind='bar', height=2.0,
+                           aspect=2.5, color='b', sharex=False,
+                           sharey=False)
+        plot.set_titles('{col_name}')
+        buffer = io.BytesIO()
+        plot.savefig(buffer, format='png')
+        plt.close(plot.figure)
+        sizes['sns.catplot'] = len(buffer.getvalue())
+
+    def tiled(workers):
+        buffer = io.BytesIO()
+        imsave(buffer, stitch_tiles(render_facets(
+            df, color='b', max_workers=workers)), format='png')
+        sizes['render_facets'] = len(buffer.getvalue())
+
+    workers = max_workers or os.cpu_count()
+    timings = {
+        'sns.catplot': _best_time(catplot, repeat),
+        'render_facets (max_workers=1)': _best_time(lambda: tiled(1),
+                                                    repeat),
+    }
+    if workers > 1:
+        timings['render_facets (max_workers={})'.format(workers)] = \
+            _best_time(lambda: tiled(workers), repeat)
+    _report('Bar plots of {} countries'.format(n_countries), timings)
+    for name, size in sizes.items():
+        print('  {:<40s} {:12,d} bytes'.format(name + ' PNG', size))
+    return timings
+
+
+def bench_fixed_effects(n_rows=20000, repeat=3):
+    """
+    Compares the runtime and peak memory of a country fixed-effects
+    regression with clustered standard errors, fitted with a dummy column
+    per country in statsmodels and with fixed_effects_ols.
+    """
+    import statsmodels.api as sm
+
+    df = synthetic_panel(n_rows)
+
+    def dummies():
+        data = df[['country', 'Happiness'] + EXPLANATORY_VARS].dropna()
+        X = sm.add_constant(pd.concat(
+            [data[EXPLANATORY_VARS],
+             pd.get_dummies(data['country'], drop_first=True, dtype=float)],
+            axis=1))
+        groups = data['country'].cat.codes.to_numpy()
+        return sm.OLS(data['Happiness'], X).fit(
+            cov_type='cluster', cov_kwds={'groups': groups})
+
+    def within():
+        return fixed_effects_ols(df)
+
+    timings = {'dummy variables': _best_time(dummies, repeat),
+               'fixed_effects_ols': _best_time(within, repeat)}
+    timings = _report('Country fixed effects over {:,} rows ({:,} '
+                      'countries)'.format(n_rows, df['country'].nunique()),
+                      timings)
+    for name, func in (('dummy variables', dummies),
+                       ('fixed_effects_ols', within)):
+        tracemalloc.start()
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print('  {:<40s} {:12.1f} MB peak'.format(name, peak / 2 ** 20))
+    return timings
+
+
+def bench_fits(n_rows=450, n_fits=200, repeat=3):
+    """
+    Compares the number of fits per second of the Regression exercise's
+    model2 (Happiness on all the explanatory variables, reading params,
+    bse, R-squared and p-values) through statsmodels and through fit_ols,
+    on a synthetic panel the size of df1517.
+    """
+    import statsmodels.api as sm
+
+    df = synthetic_panel(n_rows, n_years=3, first_year=2015)
+    Y = df['Happiness']
+    X = sm.add_constant(df[EXPLANATORY_VARS])
+
+    def statsmodels_fits(summary=False):
+        for _ in range(n_fits):
+            results = sm.OLS(Y, X, missing='drop').fit()
+            (results.params, results.bse, results.rsquared,
+             results.pvalues)
+            if summary:
+                results.summary()
+
+    def fast_fits():
+        for _ in range(n_fits):
+            results = fit_ols(Y, X)
+            (results.params, results.bse, results.rsquared,
+             results.pvalues)
+
+    timings = {
+        'sm.OLS': _best_time(statsmodels_fits, repeat),
+        'sm.OLS with summary()': _best_time(
+            lambda: statsmodels_fits(summary=True), repeat),
+        'fit_ols': _best_time(fast_fits, repeat),
+    }
+    timings = _report('{} fits of {} rows'.format(n_fits, n_rows), timings)
+    for name, seconds in timings.items():
+        print('  {:<40s} {:12,.0f} fits/s'.format(name, n_fits / seconds))
+    return timings
+
+
+def bench_groupby(n_rows=10**7, repeat=1):
+    """
+    Compares the group-bys of the GroupingKeys exercise (the mean, minimum
+    and maximum of every indicator by year, and the mean by country taken
+    twice) done with pandas, with the same aggregates from a GroupIndex of
+    each key built once.
+    """
+    df = synthetic_panel(n_rows)
+    columns = [name for name in df.columns if name not in ('country', 'year')]
+
+    def pandas_groupbys():
+        by_year = [df.groupby(['year'])[columns].mean(),
+                   df.groupby(['year'])[columns].min(),
+                   df.groupby(['year'])[columns].max()]
+        by_country = [df.groupby(['country'], observed=True)[columns].mean()
+                      for _ in range(2)]
+        return by_year, by_country[0].min(), by_country[1].max()
+
+    years = GroupIndex(df, 'year')
+    countries = GroupIndex(df, 'country')
+
+    def indexed():
+        by_year = years.aggregates(df, ('mean', 'min', 'max'), columns)
+        means = countries.mean(df, columns)
+        return by_year, means.min(), means.max()
+
+    timings = {
+        'pandas groupby': _best_time(pandas_groupbys, repeat),
+        'GroupIndex (building both indexes)': _best_time(
+            lambda: (GroupIndex(df, 'year'), GroupIndex(df, 'country')),
+            repeat),
+        'GroupIndex (reusing the indexes)': _best_time(indexed, repeat),
+    }
+    return _report('Group-by aggregates over {:,} rows'.format(n_rows),
+                   timings)
+
+
+def bench_grouped(n_rows=20000, repeat=3):
+    """
+    Compares fitting sm.OLS of Happiness on LogGDP for each country of a
+    synthetic panel in a loop with grouped_ols.
+    """
+    import statsmodels.api as sm
+
+    df = synthetic_panel(n_rows)
+
+    def looped():
+        return {country: sm.OLS(group['Happiness'],
+                                sm.add_constant(group[['LogGDP']]),
+                                missing='drop').fit().params
+                for country, group in df.groupby('country', observed=True)}
+
+    timings = {
+        'sm.OLS loop': _best_time(looped, repeat),
+        'grouped_ols': _best_time(lambda: grouped_ols(df), repeat),
+    }
+    return _report('Per-country OLS fits over {:,} rows'.format(n_rows),
+                   timings)
+
+
+def bench_ingest(n_rows=10**6, repeat=3):
+    """
+    Compares ingesting the latest year of a synthetic panel into a WHRStore
+    with recomputing dfmean and Dystopia from the full history.
+    """
+    df = synthetic_panel(n_rows)
+    last = df['year'].max()
+    directory = tempfile.mkdtemp(prefix='whr-bench-')
+    try:
+        store = WHRStore.create(directory + '/store', df[df['year'] < last])
+        edition = df[df['year'] == last]
+
+        def incremental():
+            store.ingest(edition)
+            return store.dfmean(), store.dystopia()
+
+        def full():
+            dfmean = df.groupby('country', observed=True).mean()
+            window = df[df['year'].isin(range(last - 2, last + 1))]
+            means = window.groupby('country', observed=True).mean()
+            dystopia = means.min()
+            dystopia['Corruption'] = means['Corruption'].max()
+            return dfmean, dystopia[EXPLANATORY_VARS]
+
+        timings = {
+            'recompute from full history': _best_time(full, repeat),
+            'WHRStore.ingest': _best_time(incremental, repeat),
+        }
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return _report('Adding one year to a {:,}-row panel'.format(n_rows),
+                   timings)
+
+
+def bench_olap(n_rows=10**7, n_regions=10, repeat=3):
+    """
+    Compares a dashboard of the group-bys of the GroupingCuts and
+    GroupingKeys exercises (the means of the indicators by bins of
+    Happiness and year, by deciles of LogGDP and region, by region for the
+    last three years, and the count of rows by year and region) recomputed
+    with pd.cut and groupby each time with the same queries of an OLAPCube,
+    and adding the last year to the cube with rebuilding it.  The region of
+    each country is made up, as the panel has none.
+    """
+    df = synthetic_panel(n_rows)
+    df['Happiness'] = df['Happiness'] + 5
+    regions = pd.Categorical(['Region {}'.format(k)
+                              for k in range(n_regions)])
+    df['region'] = regions[df.country.cat.codes % n_regions]
+    numeric = df.drop(columns=['country'])
+    measures = [name for name in INDICATORS if name != 'Happiness']
+    happiness = Bins.cut(df.Happiness, bins=list(range(0, 11)))
+    deciles = Bins.cut(df.LogGDP, bins=10)
+    dimensions = {'Happiness': happiness, 'LogGDP': deciles, 'year': None,
+                  'region': None}
+    last = df.year.max()
+    recent = [last - 2, last - 1, last]
+
+    def pandas_dashboard():
+        return (numeric.groupby([pd.cut(df.Happiness, happiness.edges),
+                                 'year'], observed=False)[measures].mean(),
+                numeric.groupby([pd.cut(df.LogGDP, deciles.edges), 'region'],
+                                observed=False)[measures].mean(),
+                numeric[df.year.isin(recent)].groupby(
+                    'region', observed=False)[measures].mean(),
+                df.groupby(['year', 'region'], observed=False).size())
+
+    def build():
+        return OLAPCube.from_frame(df, dimensions, measures)
+
+    cube = build()
+
+    def cube_dashboard():
+        return (cube.query(['Happiness', 'year'], ['mean']),
+                cube.query(['LogGDP', 'region'], ['mean']),
+                cube.query('region', ['mean'], where={'year': recent}),
+                cube.aggregate('size', by=['year', 'region']))
+
+    old = df[df.year < last]
+    new = df[df.year == last]
+    earlier = OLAPCube.from_frame(old, dimensions, measures)
+    # update changes the cube, so each run adds the year to a fresh copy.
+    copies = iter([copy.deepcopy(earlier) for _ in range(repeat)])
+
+    timings = {
+        'pd.cut / groupby dashboard': _best_time(pandas_dashboard, repeat),
+        'OLAPCube.from_frame': _best_time(build, repeat),
+        'OLAPCube dashboard': _best_time(cube_dashboard, repeat),
+        'OLAPCube.aggregate (one roll-up)': _best_time(
+            lambda: cube.aggregate('mean', 'LogGDP', ['year', 'region']),
+            repeat),
+        'OLAPCube.update (last year)': _best_time(
+            lambda: next(copies).update(new), repeat),
+    }
+    _report('OLAP dashboard over {:,} rows'.format(n_rows), timings)
+    refreshed = earlier.update(new)
+    print('  cube refreshed with the last year matches the full build:',
+          np.array_equal(refreshed.count, cube.count)
+          and np.allclose(refreshed.sum, cube.sum))
+    return timings
+
+
+def bench_pairplot(sizes=(10**4, 10**6), max_scatter=10**4, repeat=1):
+    """
+    Compares the pair plot of Happiness and the explanatory variables
+    colored by year of the PlotSummary exercise drawn by sns.pairplot with
+    the density version of PairHistograms, both written as a PNG, on
+    synthetic panels of each of sizes rows (sns.pairplot only up to
+    max_scatter rows), and prints the sizes of the PNGs.  The last timing
+    is that of plotting again from the histograms already computed.
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    plot_vars = ['Happiness'] + EXPLANATORY_VARS
+    timings = {}
+    png = {}
+    for n_rows in sizes:
+        df = synthetic_panel(n_rows)
+
+        def save(name, figure):
+            buffer = io.BytesIO()
+            figure.savefig(buffer, format='png')
+            plt.close(figure)
+            png['{} PNG ({:,} rows)'.format(name, n_rows)] = len(
+                buffer.getvalue())
+
+        if n_rows <= max_scatter:
+            timings['sns.pairplot ({:,} rows)'.format(n_rows)] = _best_time(
+                lambda: save('sns.pairplot', sns.pairplot(
+                    df, vars=plot_vars, hue='year', dropna=True,
+                    palette='Blues').figure), repeat)
+        histograms = PairHistograms(df, plot_vars, hue='year')
+        timings['pairplot_density ({:,} rows)'.format(n_rows)] = _best_time(
+            lambda: save('pairplot_density', pairplot_density(
+                df, plot_vars, hue='year')), repeat)
+        timings['PairHistograms.plot ({:,} rows)'.format(n_rows)] = \
+            _best_time(lambda: save('PairHistograms.plot',
+                                    histograms.plot()), repeat)
+    _report('Pair plots of {} variables'.format(len(plot_vars)), timings)
+    for name, size in png.items():
+        print('  {:<40s} {:12,d} bytes'.format(name, size))
+    return timings
+
+
+def bench_qcut(n_rows=10**7, q=4, error=0.001, chunksize=10**6, repeat=1):
+    """
+    Compares the quartiles of LogGDP of the GroupingCuts exercise,
+    df.groupby(pd.qcut(df.LogGDP, q=4)).size(), with StreamingQcut over
+    chunks of a synthetic panel, and prints how far the sizes of its bins
+    are from those of the exact quartiles.
+    """
+    df = synthetic_panel(n_rows)
+
+    def exact():
+        return df.groupby(pd.qcut(df.LogGDP, q=q), observed=False).size()
+
+    def streamed():
+        binning = StreamingQcut('LogGDP', q, error, seed=0)
+        for start in range(0, n_rows, chunksize):
+            binning.update(df.iloc[start:start + chunksize])
+        for start in range(0, n_rows, chunksize):
+            binning.assign(df.iloc[start:start + chunksize])
+        return binning
+
+    timings = {
+        'pd.qcut group-by': _best_time(exact, repeat),
+        'StreamingQcut (two passes)': _best_time(streamed, repeat),
+    }
+    report = streamed().report()
+    _report('{} equal-frequency bins over {:,} rows'.format(q, n_rows),
+            timings)
+    report['Exact'] = exact().to_numpy()
+    print(report.to_string())
+    return timings
+
+
+def bench_ridge(n_rows=10**5, n_alphas=200, repeat=3):
+    """
+    Compares refitting a ridge regression of Happiness on the explanatory
+    variables for each penalty with statsmodels' fit_regularized against
+    ridge_path, on a synthetic panel.
+    """
+    import statsmodels.api as sm
+
+    df = synthetic_panel(n_rows)
+    alphas = np.logspace(-3, 5, n_alphas)
+    data = df[EXPLANATORY_VARS + ['Happiness']].dropna()
+    X = data[EXPLANATORY_VARS]
+    X = (X - X.mean()) / X.std(ddof=0)
+    y = data['Happiness'] - data['Happiness'].mean()
+    n = len(data)
+
+    def looped():
+        # fit_regularized scales the squared error by 1 / (2 n).
+        model = sm.OLS(y, X)
+        return [model.fit_regularized(alpha=alpha / n, L1_wt=0).params
+                for alpha in alphas]
+
+    timings = {
+        'fit_regularized loop': _best_time(looped, repeat),
+        'ridge_path': _best_time(lambda: ridge_path(df, alphas=alphas),
+                                 repeat),
+    }
+    return _report('Ridge path of {} penalties over {:,} rows'.format(
+        n_alphas, n_rows), timings)
+
+
+def bench_rolling(n_rows=10**6, n_years=60, window=3, repeat=3):
+    """
+    Compares calling corr() on a filtered copy for every rolling window of
+    years of a synthetic panel with rolling_corr.
+    """
+    df = synthetic_panel(n_rows, n_years=n_years).drop(columns=['country'])
+    first = df['year'].min()
+
+    def looped():
+        return [df.loc[(df['year'] >= start)
+                       & (df['year'] < start + window)].drop(
+                           columns=['year']).corr()
+                for start in range(first, first + n_years - window + 1)]
+
+    timings = {
+        'corr() loop': _best_time(looped, repeat),
+        'rolling_corr': _best_time(lambda: rolling_corr(df, window),
+                                   repeat),
+    }
+    return _report('{} rolling {}-year correlation windows over {:,} '
+                   'rows'.format(n_years - window + 1, window, n_rows),
+                   timings)
+
+
+def bench_subsets(n_rows=10**5, repeat=3):
+    """
+    Compares fitting sm.OLS for every subset of the explanatory variables
+    with all_subsets_ols, on a synthetic panel with 5% missing values.
+    """
+    import statsmodels.api as sm
+
+    df = synthetic_panel(n_rows)
+    subsets = [list(subset) for size in range(1, len(EXPLANATORY_VARS) + 1)
+               for subset in combinations(EXPLANATORY_VARS, size)]
+
+    def looped():
+        return [sm.OLS(df['Happiness'], sm.add_constant(df[subset]),
+                       missing='drop').fit() for subset in subsets]
+
+    timings = {
+        'sm.OLS loop': _best_time(looped, repeat),
+        'all_subsets_ols': _best_time(lambda: all_subsets_ols(df), repeat),
+    }
+    return _report('OLS fits of {} subsets over {:,} rows'.format(
+        len(subsets), n_rows), timings)
+
+
+def bench_summary(n_rows=10**7, n_years=60, repeat=1):
+    """
+    Compares calling produce_summary_table on a filtered copy for every
+    rolling 3-year window of a synthetic panel with produce_summary_tables.
+    """
+    df = synthetic_panel(n_rows, n_years=n_years)
+    first = df['year'].min()
+    windows = [(start, start + 2) for start in range(first,
+                                                     first + n_years - 2)]
+
+    def looped():
+        return [produce_summary_table(df.loc[(df['year'] >= start)
+                                             & (df['year'] <= stop)])
+                for start, stop in windows]
+
+    timings = {
+        'produce_summary_table loop': _best_time(looped, repeat),
+        'produce_summary_tables': _best_time(
+            lambda: produce_summary_tables(df, windows), repeat),
+    }
+    return _report('{} summary windows over {:,} rows'.format(len(windows),
+                                                              n_rows),
+                   timings)
+
+
+BENCHMARKS = {
+    'binning': bench_binning,
+    'bootstrap': bench_bootstrap,
+    'corr': bench_corr,
+    'dystopia': bench_dystopia,
+    'facets': bench_facets,
+    'fits': bench_fits,
+    'fixed_effects': bench_fixed_effects,
+    'groupby': bench_groupby,
+    'grouped': bench_grouped,
+    'ingest': bench_ingest,
+    'load': bench_load,
+    'olap': bench_olap,
+    'projection': bench_projection,
+    'pairplot': bench_pairplot,
+    'qcut': bench_qcut,
+    'panel': bench_panel,
+    'ridge': bench_ridge,
+    'rolling': bench_rolling,
+    'sheets': bench_sheets,
+    'subsets': bench_subsets,
+    'summary': bench_summary,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('benchmark', choices=sorted(BENCHMARKS))
+    parser.add_argument('--path', default=WHR_FILE,
+                        help='path to the WHR workbook')
+    parser.add_argument('--rows', type=int,
+                        help='rows of synthetic data, where used')
+    args = parser.parse_args(argv)
+    bench = BENCHMARKS[args.benchmark]
+    accepted = inspect.signature(bench).parameters
+    options = {'path': args.path, 'n_rows': args.rows}
+    bench(**{name: value for name, value in options.items()
+             if name in accepted and value is not None})
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,401 @@
+"""
+Binning of the WHR indicators with edges computed once.
+
+The GroupingCuts exercise groups the rows by bins of an indicator, as in
+
+    df.groupby(pd.cut(df.Happiness, bins=list(range(0, 11)))).mean()
+    df.groupby(pd.cut(df.LogGDP, bins=10)).size()
+    df.groupby(pd.qcut(df.LogGDP, q=4)).size()
+
+and each call builds a categorical of Interval labels and a new group-by.
+Bins holds the edges of a binning (given, or computed from the data the way
+pd.cut and pd.qcut compute them) and assigns values to bins with a binary
+search of the edges.  BinnedTotals accumulates the per-bin counts and sums of
+any columns with np.bincount, one chunk of rows at a time if need be, so
+that the same edges serve every refresh and every chunk of streamed data.
+
+pd.qcut sorts the whole column to find its quantiles.  StreamingQcut finds
+approximate quantiles in one pass over chunks of data with a KLLSketch, then
+counts the rows of each resulting bin in a second pass, and reports how far
+each bin's size can be from that of the exact pd.qcut bins.
+"""
+
+import numpy as np
+import pandas as pd
+
+from .sketch import KLLSketch
+from .summary import _indicators
+
+
+def _qcut_quantiles(q):
+    # The quantiles pd.qcut(x, q) cuts at.
+    if np.ndim(q) > 0:
+        return np.asarray(q, dtype=np.float64)
+    quantiles = np.linspace(0, 1, q + 1)
+    # pd.qcut rounds up the quantiles that are not exact in binary.
+    np.putmask(quantiles, q * quantiles != np.arange(q + 1),
+               np.nextafter(quantiles, 1))
+    return quantiles
+
+
+class Bins:
+    """
+    The bins between consecutive edges, each including its right edge (or
+    its left edge if right is False), as pd.cut(x, edges, right=right,
+    include_lowest=include_lowest) forms them.
+    """
+
+    def __init__(self, edges, right=True, include_lowest=False):
+        # Integer edges stay integers, as they do in the labels of pd.cut.
+        self.edges = np.asarray(edges)
+        if not np.issubdtype(self.edges.dtype, np.number):
+            raise ValueError('bin edges must be numbers')
+        if self.edges.ndim != 1 or len(self.edges) < 2 or \
+                np.isnan(self.edges).any():
+            raise ValueError('bins need at least two edges, none missing')
+        if np.any(np.diff(self.edges) <= 0):
+            raise ValueError('bin edges must increase monotonically')
+        self.right = right
+        self.include_lowest = include_lowest
+        self._categories = None
+
+    @classmethod
+    def cut(cls, values, bins=10, right=True, include_lowest=False):
+        """
+        Returns the bins pd.cut(values, bins, right=right) uses: bins may be
+        a sequence of edges, or a number of bins of equal width spanning the
+        range of values, widened by 0.1% of the range at the open end.
+        """
+        if np.ndim(bins) > 0:
+            return cls(bins, right, include_lowest)
+        if bins < 1:
+            raise ValueError('bins should be a positive integer')
+        values = np.asarray(values, dtype=np.float64)
+        if not np.any(~np.isnan(values)):
+            raise ValueError('cannot cut values that are all missing')
+        low, high = np.nanmin(values), np.nanmax(values)
+        if np.isinf(low) or np.isinf(high):
+            raise ValueError('cannot compute the bins of infinite values')
+        if low == high:
+            low -= 0.001 * abs(low) if low != 0 else 0.001
+            high += 0.001 * abs(high) if high != 0 else 0.001
+            edges = np.linspace(low, high, bins + 1)
+        else:
+            edges = np.linspace(low, high, bins + 1)
+            adjustment = (high - low) * 0.001
+            if right:
+                edges[0] -= adjustment
+            else:
+                edges[-1] += adjustment
+        return cls(edges, right, include_lowest)
+
+    @classmethod
+    def qcut(cls, values, q=4):
+        """
+        Returns the bins pd.qcut(values, q) uses: q is a number of bins
+        holding equal numbers of values, or a sequence of quantiles, and the
+        edges are those quantiles of the values that are present.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        edges = np.quantile(values[~np.isnan(values)], _qcut_quantiles(q))
+        return cls(edges, right=True, include_lowest=True)
+
+    @classmethod
+    def from_sketch(cls, sketch, q=4):
+        """
+        Returns the bins pd.qcut(values, q) would use, with the quantiles of
+        the values estimated by the KLLSketch sketch of them.
+        """
+        return cls(sketch.quantiles(_qcut_quantiles(q)), right=True,
+                   include_lowest=True)
+
+    def __len__(self):
+        return len(self.edges) - 1
+
+    @property
+    def categories(self):
+        """
+        The Interval labels of the bins, as pd.cut gives them.
+        """
+        if self._categories is None:
+            self._categories = pd.cut(
+                np.empty(0), self.edges, right=self.right,
+                include_lowest=self.include_lowest).categories
+        return self._categories
+
+    def _bin_numbers(self, values):
+        """
+        Returns the number of the bin of each of values, or len(self) for
+        missing values and values outside every bin.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        # numbers[i] is the number of edges below values[i] (or at most
+        # values[i] if right is False), which is what a binary search of the
+        # edges gives.  For a few edges one vectorized comparison per edge is
+        # faster than a binary search per value.
+        if len(self.edges) <= 16:
+            numbers = np.zeros(len(values), dtype=np.uint8)
+            compare = np.greater if self.right else np.greater_equal
+            for edge in self.edges:
+                np.add(numbers, compare(values, edge), out=numbers,
+                       casting='unsafe')
+        else:
+            numbers = np.searchsorted(self.edges, values,
+                                      side='left' if self.right else 'right')
+        if self.include_lowest:
+            numbers[values == self.edges[0]] = 1
+        numbers[numbers == 0] = len(self.edges)
+        numbers[np.isnan(values)] = len(self.edges)
+        numbers -= 1
+        return numbers
+
+    def codes(self, values):
+        """
+        Returns the number of the bin of each of values, or -1 for missing
+        values and values outside every bin.
+        """
+        codes = self._bin_numbers(values).astype(np.intp)
+        codes[codes == len(self)] = -1
+        return codes
+
+    def categorical(self, values):
+        """
+        Returns the bin of each of values as the categorical pd.cut gives.
+        """
+        return pd.Categorical.from_codes(self.codes(values), self.categories,
+                                         ordered=True)
+
+    def counts(self, values):
+        """
+        Returns the number of values in each bin, as
+        x.groupby(pd.cut(x, ...), observed=False).size() gives it.
+        """
+        numbers = self._bin_numbers(values)
+        return pd.Series(np.bincount(numbers, minlength=len(self) + 1)[:-1],
+                         index=self._index(getattr(values, 'name', None)))
+
+    def _index(self, name):
+        return pd.CategoricalIndex(self.categories, ordered=True, name=name)
+
+    def mean(self, df, by, columns=None, chunksize=2**20):
+        """
+        Returns the mean of the columns of df (by default its numeric
+        columns) within each bin of the column by, as
+        df.groupby(pd.cut(df[by], ...), observed=False).mean() gives it.
+        The rows are taken chunksize at a time, which keeps the work on
+        each chunk in the cache.
+        """
+        totals = BinnedTotals(self, by, columns)
+        for start in range(0, max(len(df), 1), chunksize):
+            totals.update(df.iloc[start:start + chunksize])
+        return totals.mean()
+
+
+class BinnedTotals:
+    """
+    The number of rows in each of bins of the column by, and the count and
+    sum of the values present of each of the given columns within each bin.
+    The totals are updated with one chunk of rows at a time, and totals
+    computed separately over the same bins can be merged.
+    """
+
+    def __init__(self, bins, by, columns=None):
+        self.bins = bins
+        self.by = by
+        self.columns = None if columns is None else list(columns)
+        self.size = np.zeros(len(bins), dtype=np.int64)
+        self.count = None
+        self.sum = None
+
+    def _start(self, columns):
+        self.columns = columns
+        self.count = np.zeros((len(self.bins), len(columns)),
+                              dtype=np.int64)
+        self.sum = np.zeros((len(self.bins), len(columns)))
+
+    def update(self, chunk):
+        """
+        Adds the rows of the dataframe chunk, ignoring missing values.
+        """
+        if self.count is None:
+            columns = self.columns
+            if columns is None:
+                columns = _indicators(chunk)
+            self._start(columns)
+        # Rows outside every bin go to an extra bin at the end, which is
+        # dropped, rather than being filtered out of every column.
+        size = len(self.bins)
+        numbers = self.bins._bin_numbers(chunk[self.by])
+        rows = np.bincount(numbers, minlength=size + 1)
+        self.size += rows[:size]
+        for j, name in enumerate(self.columns):
+            values = chunk[name].to_numpy(dtype=np.float64)
+            missing = np.isnan(values)
+            if missing.any():
+                self.count[:, j] += (rows - np.bincount(
+                    numbers[missing], minlength=size + 1))[:size]
+                values = np.where(missing, 0, values)
+            else:
+                self.count[:, j] += rows[:size]
+            self.sum[:, j] += np.bincount(numbers, weights=values,
+                                          minlength=size + 1)[:size]
+        return self
+
+    def merge(self, other):
+        """
+        Adds the totals other, which must be over the same bins, column by
+        and columns.
+        """
+        if (not np.array_equal(other.bins.edges, self.bins.edges)
+                or other.bins.right != self.bins.right
+                or other.by != self.by
+                or None not in (self.columns, other.columns)
+                and other.columns != self.columns):
+            raise ValueError('cannot merge totals over different bins or '
+                             'columns')
+        self.size += other.size
+        if other.count is not None:
+            if self.count is None:
+                self._start(other.columns)
+            self.count += other.count
+            self.sum += other.sum
+        return self
+
+    def _frame(self, values):
+        return pd.DataFrame(values, index=self.bins._index(self.by),
+                            columns=self.columns)
+
+    def counts(self):
+        """
+        Returns the number of rows in each bin.
+        """
+        return pd.Series(self.size, index=self.bins._index(self.by))
+
+    def sums(self):
+        """
+        Returns the sum of each column within each bin.
+        """
+        return self._frame(self.sum)
+
+    def mean(self):
+        """
+        Returns the mean of each column within each bin, NaN for bins with
+        no values.
+        """
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self._frame(self.sum / self.count)
+
+
+class StreamingQcut:
+    """
+    Equal-frequency bins of the column by, as pd.qcut(df[by], q) forms
+    them, for data streamed in chunks.  The bins are estimated in a first
+    pass, in which every chunk is given to update (and states built
+    separately can be merged), from a KLLSketch whose quantiles are within
+    error (a fraction of N) of their exact rank.  The rows are then counted
+    bin by bin in a second pass, in which every chunk is given to assign,
+    along with the count and sum of the given columns.
+    """
+
+    def __init__(self, by, q=4, error=0.001, columns=(), seed=None):
+        self.by = by
+        self.q = q
+        self.columns = list(columns)
+        self.sketch = KLLSketch.from_error(error, seed)
+        self.totals = None
+        self._bins = None
+
+    def update(self, chunk):
+        """
+        Adds the values of the column by of the dataframe chunk to the
+        first pass.
+        """
+        if self.totals is not None:
+            raise ValueError('cannot add values once the second pass has '
+                             'started')
+        self.sketch.update(chunk[self.by].to_numpy(dtype=np.float64))
+        self._bins = None
+        return self
+
+    def merge(self, other):
+        """
+        Adds the values summarized by the state other, which must be over the
+        same column and quantiles and in the same pass: both in the first
+        pass, or both in the second pass with the same bins.
+        """
+        if other.by != self.by or np.any(_qcut_quantiles(other.q)
+                                          != _qcut_quantiles(self.q)):
+            raise ValueError('cannot merge binnings of different columns or '
+                             'quantiles')
+        if self.totals is None and other.totals is None:
+            self.sketch.merge(other.sketch)
+            self._bins = None
+        elif self.totals is not None and other.totals is not None:
+            self.totals.merge(other.totals)
+        else:
+            raise ValueError('cannot merge binnings in different passes')
+        return self
+
+    @property
+    def bins(self):
+        """
+        The estimated bins, which are fixed once the second pass starts.
+        """
+        if self.totals is not None:
+            return self.totals.bins
+        if self._bins is None:
+            self._bins = Bins.from_sketch(self.sketch, self.q)
+        return self._bins
+
+    def assign(self, chunk):
+        """
+        Adds the rows of the dataframe chunk to the second pass.  The bin of
+        each row of a chunk is given by self.bins.categorical(chunk[by]).
+        """
+        if self.totals is None:
+            self.totals = BinnedTotals(self.bins, self.by, self.columns)
+        self.totals.update(chunk)
+        return self
+
+    def size_bounds(self):
+        """
+        Returns, for each bin, the most its number of rows can differ from
+        the fraction of N it should hold, when the values are distinct.
+        Each estimated edge is within the error of the sketch of its exact
+        rank (the lowest and highest edges are exact), and exact quantiles
+        round a bin's size by less than one row.
+        """
+        quantiles = _qcut_quantiles(self.q)
+        error = np.where((quantiles > 0) & (quantiles < 1),
+                         self.sketch.error, 0)
+        return (error[:-1] + error[1:]) * self.sketch.n + 1
+
+    def report(self):
+        """
+        Returns a dataframe with one row per bin giving its number of rows
+        N (counted in the second pass), the number it should hold, and the
+        bound on the difference from size_bounds.
+        """
+        if self.totals is None:
+            raise ValueError('no rows have been assigned to bins yet')
+        expected = np.diff(_qcut_quantiles(self.q)) * self.sketch.n
+        counts = self.totals.counts()
+        return pd.DataFrame({'N': counts.to_numpy(), 'Expected': expected,
+                             'Bound': self.size_bounds()},
+                            index=counts.index)
+
+
+def qcut_csv(path, by, q=4, error=0.001, columns=(), chunksize=10**6,
+             seed=None, **kwargs):
+    """
+    Returns the StreamingQcut of the column by of the CSV file at path,
+    read chunksize rows at a time, after both passes over the file.
+    Further keyword arguments are passed to pd.read_csv.
+    """
+    binning = StreamingQcut(by, q, error, columns, seed)
+    kwargs['usecols'] = [by] + [name for name in columns if name != by]
+    for chunk in pd.read_csv(path, chunksize=chunksize, **kwargs):
+        binning.update(chunk)
+    for chunk in pd.read_csv(path, chunksize=chunksize, **kwargs):
+        binning.assign(chunk)
+    return binning
@@ -0,0 +1,541 @@
+"""
+Correlation matrices of the WHR indicators.
+
+The Correlations exercise computes df1517.corr(), whose Pearson
+coefficients only use, for each pair of columns, the rows where both are
+present ("pairwise-complete" observations).  Everything here keeps that
+definition, working from pairwise co-moments:
+
+    n[i, j]  number of rows where columns i and j are both present
+    s[i, j]  sum of column i over those rows
+    q[i, j]  sum of squares of column i over those rows
+    c[i, j]  sum of products of columns i and j over those rows
+
+All of them are sums over rows, so they can be added and subtracted chunk
+by chunk, and each is a single masked matrix product.  The columns are
+shifted by a fixed vector beforehand to keep the sums well conditioned.
+
+pairwise_corr computes the whole matrix at once this way, with Spearman
+coefficients computed from ranks taken once per column and Kendall's tau
+with Knight's O(n log n) algorithm.
+
+rolling_corr computes the matrices of many windows of years from the
+co-moments of each year, adding the year that enters a window and
+subtracting the one that leaves it.
+
+bootstrap_corr puts confidence intervals on the Pearson coefficients by
+resampling countries.  Since co-moments add up, the co-moments of a
+resample are those of each country weighted by the number of times it was
+drawn, and a whole batch of resamples is one matrix product.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+import numpy as np
+import pandas as pd
+
+from .summary import _indicators, _sorted_groups
+
+
+def _column_means(values):
+    # The mean of each column ignoring NaNs, or 0 for an empty column.
+    present = ~np.isnan(values)
+    count = present.sum(axis=0)
+    total = np.where(present, values, 0).sum(axis=0)
+    return np.divide(total, count, out=np.zeros(values.shape[1]),
+                     where=count > 0)
+
+
+def _comoments(values, shift):
+    """
+    Returns the pairwise co-moments (n, s, q, c) of the rows of the 2-D
+    array values, shifted by shift, with NaN marking missing values.
+    """
+    present = ~np.isnan(values)
+    mask = present.astype(np.float64)
+    centered = np.where(present, values - shift, 0)
+    return (mask.T @ mask, centered.T @ mask, (centered ** 2).T @ mask,
+            centered.T @ centered)
+
+
+def _reshift(moments, delta):
+    """
+    Returns the co-moments moments, computed with some shift, as they would
+    have been computed with that shift plus delta.
+    """
+    n, s, q, c = moments
+    d = delta[:, None]
+    s_new = s - d * n
+    q_new = q - 2 * d * s + d ** 2 * n
+    c_new = c - d * s.T - delta[None, :] * s + d * delta[None, :] * n
+    return n, s_new, q_new, c_new
+
+
+def _correlation(n, s, q, c):
+    """
+    Returns the pairwise-complete Pearson correlations from co-moments,
+    which may carry leading batch dimensions in front of the last two.
+    Pairs with fewer than two rows, or with a constant column, are NaN.
+    """
+    s_t = np.swapaxes(s, -1, -2)
+    q_t = np.swapaxes(q, -1, -2)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cov = c - s * s_t / n
+        var_x = q - s ** 2 / n
+        var_y = q_t - s_t ** 2 / n
+        r = cov / np.sqrt(var_x * var_y)
+    # Rounding can leave a tiny positive variance for a constant column.
+    flat = (var_x <= 1e-12 * q) | (var_y <= 1e-12 * q_t)
+    r = np.where((n < 2) | flat, np.nan, np.clip(r, -1, 1))
+    # The diagonal is exactly 1 for every column that is not constant.
+    eye = np.eye(r.shape[-1], dtype=bool)
+    return np.where(eye & ~np.isnan(r), 1.0, r)
+
+
+class OnlineCorrelation:
+    """
+    Keeps the pairwise co-moments of the given columns so that their
+    correlation matrix can be kept current as rows are added or removed.
+    The matrix itself is computed on demand, in time proportional to the
+    number of pairs of columns.
+
+    The shift subtracted from each column defaults to its mean in the first
+    chunk that is added.
+    """
+
+    def __init__(self, columns, shift=None):
+        self.columns = list(columns)
+        size = len(self.columns)
+        self.shift = None if shift is None else np.asarray(shift, float)
+        self._moments = tuple(np.zeros((size, size)) for _ in range(4))
+
+    def _values(self, chunk):
+        values = chunk[self.columns].to_numpy(dtype=np.float64)
+        if self.shift is None:
+            self.shift = _column_means(values)
+        return values
+
+    def add(self, chunk):
+        """
+        Adds the rows of the dataframe chunk.
+        """
+        update = _comoments(self._values(chunk), self.shift)
+        self._moments = tuple(a + b for a, b in zip(self._moments, update))
+        return self
+
+    def remove(self, chunk):
+        """
+        Removes the rows of the dataframe chunk, which must have been added
+        before.
+        """
+        update = _comoments(self._values(chunk), self.shift)
+        self._moments = tuple(a - b for a, b in zip(self._moments, update))
+        return self
+
+    def merge(self, other):
+        """
+        Adds the rows accumulated by other, which must be over the same
+        columns.
+        """
+        if other.columns != self.columns:
+            raise ValueError('cannot merge correlations of different columns')
+        if other.shift is None:
+            return self
+        if self.shift is None:
+            self.shift = other.shift.copy()
+        update = _reshift(other._moments, self.shift - other.shift)
+        self._moments = tuple(a + b for a, b in zip(self._moments, update))
+        return self
+
+    @property
+    def nobs(self):
+        """
+        The number of pairwise-complete rows for each pair of columns.
+        """
+        return pd.DataFrame(self._moments[0], index=self.columns,
+                            columns=self.columns)
+
+    def corr(self):
+        """
+        Returns the correlation matrix of the rows added so far, as
+        DataFrame.corr() would compute it.
+        """
+        return pd.DataFrame(_correlation(*self._moments),
+                            index=self.columns, columns=self.columns)
+
+
+def _dense_ranks(values):
+    """
+    Returns the dense ranks (0, 1, 2, ...) of the present values of each
+    column of values, and -1 where values are missing.
+    """
+    ranks = np.full(values.shape, -1, dtype=np.int64)
+    for j in range(values.shape[1]):
+        present = ~np.isnan(values[:, j])
+        ranks[present, j] = np.unique(values[present, j],
+                                      return_inverse=True)[1].ravel()
+    return ranks
+
+
+def _average_ranks(dense):
+    """
+    Returns the average ranks (1-based, ties sharing the mean of their
+    ranks) of values given by their dense ranks, in linear time.
+    """
+    counts = np.bincount(dense)
+    ends = np.cumsum(counts)
+    return (ends - (counts - 1) / 2)[dense]
+
+
+def _mismatched(present, i):
+    """
+    Returns the columns after column i that are not missing in exactly the
+    same rows as column i.
+    """
+    same = (present[:, i + 1:] == present[:, i:i + 1]).all(axis=0)
+    return np.flatnonzero(~same) + i + 1
+
+
+def _restricted_ranks(counted, low, high, ties):
+    """
+    Returns the average ranks, among the values counted, of the rows of a
+    2-D array of values sorted along each row, less their mean, and 0 for
+    the values not counted.  low and high bound the run of values tied with
+    each value, and ties says which rows have tied values at all.
+    """
+    below = np.zeros((counted.shape[0], counted.shape[1] + 1))
+    np.cumsum(counted, axis=1, out=below[:, 1:])
+    # Without ties the rank of a value counted is the number of values
+    # counted up to it.
+    ranks = below[:, 1:]
+    if ties.any():
+        tied = below[ties]
+        before = np.take_along_axis(tied, low[ties], axis=1)
+        after = np.take_along_axis(tied, high[ties], axis=1)
+        ranks = ranks.copy()
+        ranks[ties] = before + (after - before + 1) / 2
+    # The ranks of k values average (k + 1) / 2, with or without ties.
+    ranks -= (below[:, -1:] + 1) / 2
+    ranks[~counted] = 0
+    return ranks
+
+
+def _spearman(values, ranks, present, block=2 ** 22):
+    """
+    Returns the pairwise-complete Spearman correlations of the columns of
+    values, whose dense ranks are ranks.
+    """
+    n, size = values.shape
+    # Ranks taken once over each column are the pairwise ranks for every
+    # pair of columns missing in the same rows.
+    averaged = np.full(values.shape, np.nan)
+    for j in range(size):
+        averaged[present[:, j], j] = _average_ranks(ranks[present[:, j], j])
+    r = _correlation(*_comoments(averaged, _column_means(averaged)))
+
+    # Other pairs are re-ranked over their common rows without sorting
+    # again: each column is sorted once, and the rank of a value among the
+    # rows kept is the number of rows kept sorted before it.  The columns
+    # are laid out as rows here, so that each is contiguous.
+    order = np.argsort(ranks.T, axis=1, kind='stable')
+    position = np.empty_like(order)
+    np.put_along_axis(position, order, np.arange(n)[None, :], axis=1)
+    sorted_present = np.take_along_axis(present.T, order, axis=1)
+    # The bounds of the run of tied values around each sorted position,
+    # found by searching all columns at once, each offset past the last.
+    keys = (np.take_along_axis(ranks.T, order, axis=1) +
+            np.arange(size)[:, None] * (n + 1)).ravel()
+    offsets = np.arange(size)[:, None] * n
+    low = np.searchsorted(keys, keys, side='left').reshape(size, n) - offsets
+    high = np.searchsorted(keys, keys, side='right').reshape(size, n) - \
+        offsets
+    ties = ((high - low > 1) & sorted_present).any(axis=1)
+
+    step = max(block // max(n, 1), 1)
+    for i in range(size - 1):
+        mismatched = _mismatched(present, i)
+        for start in range(0, len(mismatched), step):
+            js = mismatched[start:start + step]
+            shape = (len(js), n)
+            # Column i ranked over the rows of each column j, in the order
+            # of column i, and each column j over the rows of column i, in
+            # its own order and then in the order of column i.
+            x = _restricted_ranks(
+                sorted_present[i] & present.T[np.ix_(js, order[i])],
+                np.broadcast_to(low[i], shape),
+                np.broadcast_to(high[i], shape), ties[[i] * len(js)])
+            y = _restricted_ranks(sorted_present[js] & present[order[js], i],
+                                  low[js], high[js], ties[js])
+            y = np.take(y, position[np.ix_(js, order[i])] +
+                        np.arange(len(js))[:, None] * n)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                r[i, js] = r[js, i] = np.einsum('ij,ij->i', x, y) / np.sqrt(
+                    np.einsum('ij,ij->i', x, x) * np.einsum('ij,ij->i', y, y))
+    return r
+
+
+def _group_starts(*keys):
+    # True where a run of equal keys starts, for elements sorted by keys.
+    new = np.zeros(len(keys[0]), dtype=bool)
+    new[:1] = True
+    for key in keys:
+        new[1:] |= key[1:] != key[:-1]
+    return new
+
+
+def _segment_inversions(segment, y, n_segments):
+    """
+    Returns, for each segment of the non-negative integers y (sorted by
+    segment), the number of pairs i < j with y[i] > y[j].
+
+    This is a radix sort of all segments at once, from the highest bit of
+    y down.  At each bit the values with equal higher bits are split,
+    keeping their order, into those with the bit clear and those with it
+    set, and every value with the bit clear is inverted with the values
+    before it that have it set.  Each step is a few cumulative sums, so the
+    whole count is O(n log n).
+    """
+    bits = int(y.max(initial=0)).bit_length()
+    # Segments and values packed into one key, so that a run of equal
+    # segment and higher bits is a run of equal key >> (shift + 1).
+    keys = (segment.astype(np.int64) << bits) | y
+    index = np.arange(len(y))
+    inverted = np.zeros(len(y))
+    for shift in reversed(range(bits)):
+        bit = ((keys >> shift) & 1).astype(np.intp)
+        new = _group_starts(keys >> (shift + 1))
+        starts = np.flatnonzero(new)
+        run = np.cumsum(new) - 1
+        ones = np.cumsum(bit) - bit
+        ones_before = ones - ones[starts][run]
+        clear = bit == 0
+        inverted += np.where(clear, ones_before, 0)
+        # The values of each run with the bit set go after those with it
+        # clear.
+        first_set = (starts + np.add.reduceat(clear, starts))[run]
+        positions = np.where(clear, index - ones_before,
+                             first_set + ones_before)
+        sorted_keys = np.empty_like(keys)
+        sorted_keys[positions] = keys
+        keys = sorted_keys
+    return np.bincount(segment, inverted, minlength=n_segments)
+
+
+def _segment_kendall(segment, x, y, n_segments):
+    """
+    Returns Kendall's tau-b of the non-negative integers x and y within each
+    segment, by Knight's algorithm: sorted by x (and by y among equal x),
+    the discordant pairs are the inversions of y.
+    """
+    span = y.max(initial=0) + 1
+    order = np.argsort((segment * (x.max(initial=0) + 1) + x) * span + y)
+    segment, x, y = segment[order], x[order], y[order]
+
+    def tied(*keys):
+        # The number of pairs of equal keys in each segment, for keys that
+        # are sorted within each segment.
+        new = _group_starts(segment, *keys)
+        starts = np.flatnonzero(new)
+        counts = np.diff(np.append(starts, len(new)))
+        return np.bincount(segment[starts], counts * (counts - 1) / 2,
+                           minlength=n_segments)
+
+    x_ties = tied(x)
+    both_ties = tied(x, y)
+    keys, counts = np.unique(segment * span + y, return_counts=True)
+    y_ties = np.bincount(keys // span, counts * (counts - 1) / 2,
+                         minlength=n_segments)
+    discordant = _segment_inversions(segment, y, n_segments)
+    n = np.bincount(segment, minlength=n_segments)
+    pairs = n * (n - 1) / 2
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (pairs - x_ties - y_ties + both_ties - 2 * discordant) / \
+            np.sqrt((pairs - x_ties) * (pairs - y_ties))
+
+
+def _kendall(ranks, present):
+    """
+    Returns the pairwise-complete Kendall's tau-b of the columns whose
+    dense ranks are ranks.  All pairs that start at a given column are
+    computed together.
+    """
+    size = ranks.shape[1]
+    # Like DataFrame.corr, the diagonal is 1 for every column with data,
+    # even a constant one.
+    r = np.diag(np.where(present.any(axis=0), 1.0, np.nan))
+    for i in range(size - 1):
+        segment, rows = np.nonzero((present[:, i:i + 1] &
+                                    present[:, i + 1:]).T)
+        js = i + 1 + segment
+        r[i, i + 1:] = r[i + 1:, i] = _segment_kendall(
+            segment, ranks[rows, i], ranks[rows, js], size - i - 1)
+    return r
+
+
+def pairwise_corr(df, method='pearson'):
+    """
+    Returns the correlation matrix of the columns of df using
+    pairwise-complete observations, as df.corr(method=method) does, for
+    the methods 'pearson', 'spearman' and 'kendall'.
+
+    Each column is ranked (sorted) once.  Spearman coefficients of pairs of
+    columns missing in the same rows come from one matrix product of those
+    ranks, and the ranks of the other pairs over their common rows are
+    counted from the sorted columns.  Kendall's tau is computed for all the
+    pairs that start at a given column together.
+    """
+    values = df.to_numpy(dtype=np.float64)
+    if method == 'pearson':
+        r = _correlation(*_comoments(values, _column_means(values)))
+    elif method == 'spearman':
+        ranks = _dense_ranks(values)
+        r = _spearman(values, ranks, ranks >= 0)
+    elif method == 'kendall':
+        ranks = _dense_ranks(values)
+        r = _kendall(ranks, ranks >= 0)
+    else:
+        raise ValueError("method must be 'pearson', 'spearman' or "
+                         "'kendall'")
+    return pd.DataFrame(np.clip(r, -1, 1), index=df.columns,
+                        columns=df.columns)
+
+
+def _cluster_comoments(values, codes, n_clusters):
+    """
+    Returns the co-moments (n, s, q, c) of the rows of values within each
+    cluster, as one array of shape (4, n_clusters, columns, columns).
+    codes gives the cluster (0 to n_clusters - 1) of each row.
+    """
+    order, counts = _sorted_groups(codes, n_clusters)
+    values = values[order]
+    filled = counts > 0
+    starts = (np.cumsum(counts) - counts)[filled]
+    shift = _column_means(values)
+    size = values.shape[1]
+    moments = np.zeros((4, n_clusters, size, size))
+    if len(starts) * 64 <= len(values):
+        # Few large clusters (such as years): a matrix product per cluster.
+        ends = np.cumsum(counts)[filled]
+        for g, start, end in zip(np.flatnonzero(filled), starts, ends):
+            moments[:, g] = _comoments(values[start:end], shift)
+        return moments
+    # Many small clusters (such as countries): sums of products over the
+    # rows of each, one column at a time so that no more than rows x columns
+    # products are held at once.  Rows are laid out along the last axis so
+    # that the sums run over contiguous memory.
+    present = ~np.isnan(values.T)
+    mask = present.astype(np.float64)
+    centered = np.where(present, values.T - shift[:, None], 0)
+    for j in range(size):
+        for k, (left, right) in enumerate(((mask, mask), (centered, mask),
+                                           (centered ** 2, mask),
+                                           (centered, centered))):
+            moments[k, filled, :, j] = np.add.reduceat(left * right[j],
+                                                       starts, axis=1).T
+    return moments
+
+
+def _bootstrap_batch(moments, seed, size):
+    """
+    Returns the correlation matrices of size resamples of the clusters whose
+    co-moments are moments, drawn with the random seed.
+    """
+    n_clusters = moments.shape[1]
+    draws = np.random.default_rng(seed).integers(n_clusters,
+                                                 size=(size, n_clusters))
+    # weights[b, g] is the number of times cluster g is drawn in resample b.
+    weights = np.bincount(
+        (draws + n_clusters * np.arange(size)[:, None]).ravel(),
+        minlength=size * n_clusters).reshape(size, n_clusters)
+    shape = moments.shape
+    resampled = weights @ moments.reshape(4, n_clusters, -1)
+    return _correlation(*resampled.reshape(4, size, *shape[2:]))
+
+
+def bootstrap_corr(df, cluster='country', n_resamples=2000, confidence=0.95,
+                   batch_size=250, seed=0, max_workers=None):
+    """
+    Returns the Pearson correlations of the numeric columns of df (as
+    df.corr() gives them) with percentile bootstrap confidence intervals,
+    as a dataframe indexed by pairs of columns with the columns corr, lower
+    and upper.  result.loc['Happiness'] lists the correlations of every
+    column with Happiness.
+
+    Each of the n_resamples resamples draws as many values of the cluster
+    column as there are, with replacement, and keeps all the rows of each,
+    so that the years of a country are resampled together.  Resamples are
+    computed batch_size at a time in worker processes; batch i is drawn
+    from the i-th child of np.random.SeedSequence(seed), so the intervals
+    do not depend on max_workers.
+    """
+    columns = _indicators(df, cluster)
+    values = df[columns].to_numpy(dtype=np.float64)
+    codes, clusters = pd.factorize(df[cluster])
+    keep = codes >= 0
+    moments = _cluster_comoments(values[keep], codes[keep], len(clusters))
+
+    sizes = [min(batch_size, n_resamples - start)
+             for start in range(0, n_resamples, batch_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        batches = list(pool.map(_bootstrap_batch, repeat(moments), seeds,
+                                sizes))
+    samples = np.concatenate(batches)
+    alpha = (1 - confidence) / 2
+    with np.errstate(invalid='ignore'):
+        lower, upper = np.nanquantile(samples, [alpha, 1 - alpha], axis=0)
+
+    r = _correlation(*_comoments(values, _column_means(values)))
+    index = pd.MultiIndex.from_product([columns, columns])
+    return pd.DataFrame({'corr': r.ravel(), 'lower': lower.ravel(),
+                         'upper': upper.ravel()}, index=index)
+
+
+def rolling_corr(df, window=3, year='year'):
+    """
+    Returns the Pearson correlations of the numeric columns of df (other
+    than year) over every window of window consecutive years, moved one
+    year at a time from the first year of df to the last.  The result is
+    indexed by window label (such as '2015-2017') and column, like
+    produce_summary_tables, so that result.loc['2015-2017'] equals
+    df1517.drop(columns='year').corr(), and
+
+        result.to_numpy().reshape(n_windows, n_columns, n_columns)
+
+    is the stacked array of the matrices.
+
+    The co-moments of each year are computed once.  Each window's are
+    those of the previous window plus the year that enters it minus the
+    year that leaves it, so the cost of a window does not depend on its
+    length.
+    """
+    columns = _indicators(df, year)
+    if df.empty:
+        # No years, so no windows, as produce_summary_tables returns an
+        # empty table for an empty dataframe.
+        index = pd.MultiIndex.from_product([[], columns],
+                                           names=['window', None])
+        return pd.DataFrame(np.empty((0, len(columns))), index=index,
+                            columns=columns)
+    years = df[year].to_numpy(dtype=np.int64)
+    first = years.min()
+    n_years = years.max() - first + 1
+    moments = _cluster_comoments(df[columns].to_numpy(dtype=np.float64),
+                                 years - first, n_years)
+
+    n_windows = max(n_years - window + 1, 0)
+    stacked = np.empty((4, n_windows) + moments.shape[2:])
+    current = moments[:, :window].sum(axis=1)
+    for k in range(n_windows):
+        if k:
+            current += moments[:, k + window - 1] - moments[:, k - 1]
+        stacked[:, k] = current
+    r = _correlation(*stacked)
+
+    labels = ['{}-{}'.format(first + k, first + k + window - 1)
+              for k in range(n_windows)]
+    index = pd.MultiIndex.from_product([labels, columns],
+                                       names=['window', None])
+    return pd.DataFrame(r.reshape(-1, len(columns)), index=index,
+                        columns=columns)
@@ -0,0 +1,191 @@
+"""
+Group-by aggregation with a reusable group index.
+
+The GroupingKeys exercise computes df.groupby(['year']).mean(), .min() and
+.max() as three separate group-bys, and df1517.groupby(['country']).mean()
+twice, and each call factorizes the keys and sorts the rows again.
+GroupIndex does that work once: it keeps the group code of every row, the
+order that sorts the rows by group and the offset where each group starts.
+Any number of aggregates of any columns are then computed from it, all of
+them in one pass over each column sorted by group.
+"""
+
+import numpy as np
+import pandas as pd
+
+from .summary import _indicators, _sorted_groups
+
+
+AGGREGATES = ('count', 'sum', 'mean', 'min', 'max', 'var', 'std')
+
+
+class GroupIndex:
+    """
+    The groups of the rows of df by the column or list of columns by, as
+    df.groupby(by) forms them: sorted by key, with rows whose key is
+    missing left out.  The index can be used to aggregate any frame whose
+    rows are those of df.
+    """
+
+    def __init__(self, df, by):
+        self.by = by
+        keys = [by] if np.ndim(by) == 0 else list(by)
+        codes = []
+        uniques = []
+        for key in keys:
+            key_codes, key_uniques = pd.factorize(df[key], sort=True)
+            codes.append(key_codes)
+            uniques.append(key_uniques)
+        missing = np.zeros(len(df), dtype=bool)
+        for key_codes in codes:
+            missing |= key_codes < 0
+        if len(keys) == 1:
+            self.codes = codes[0]
+            self.groups = pd.Index(uniques[0], name=keys[0])
+        else:
+            # Number the combinations of keys that occur, in sorted order.
+            flat = np.ravel_multi_index(
+                [np.where(missing, 0, key_codes) for key_codes in codes],
+                [len(key_uniques) for key_uniques in uniques])
+            present, inverse = np.unique(flat[~missing],
+                                         return_inverse=True)
+            self.codes = np.full(len(df), -1, dtype=np.intp)
+            self.codes[~missing] = inverse.ravel()
+            positions = np.unravel_index(present, [len(key_uniques)
+                                                   for key_uniques in uniques])
+            self.groups = pd.MultiIndex.from_arrays(
+                [key_uniques[position]
+                 for key_uniques, position in zip(uniques, positions)],
+                names=keys)
+        self.keys = keys
+        # The rows with no group sort first, as group 0, and are left out.
+        order, counts = _sorted_groups(self.codes + 1, len(self.groups) + 1)
+        self.order = order[counts[0]:]
+        self.counts = counts[1:]
+        self.offsets = np.cumsum(self.counts) - self.counts
+
+    def __len__(self):
+        return len(self.groups)
+
+    def _columns(self, df, columns):
+        if columns is not None:
+            return list(columns)
+        return _indicators(df, self.keys)
+
+    def _aggregate(self, values, aggregates, block=2**16):
+        """
+        Returns a dictionary from each of aggregates to its value for every
+        group, from the values of one column.
+
+        The rows are taken in group order block rows at a time, so that
+        every aggregate is computed from a sorted block that is still in
+        the cache.  A group that straddles two blocks has its partial
+        aggregates merged, the sums of squared deviations by Chan et al.'s
+        pairwise update as in SummaryState.
+        """
+        size = len(self.groups)
+        spread = 'var' in aggregates or 'std' in aggregates
+        count = np.zeros(size)
+        total = np.zeros(size)
+        m2 = np.zeros(size)
+        low = np.full(size, np.nan)
+        high = np.full(size, np.nan)
+        for lo in range(0, len(self.order), block):
+            sorted_values = values[self.order[lo:lo + block]]
+            hi = lo + len(sorted_values)
+            # The groups with rows in this block, and where each starts.
+            first = np.searchsorted(self.offsets, lo, side='right') - 1
+            last = np.searchsorted(self.offsets, hi)
+            starts = self.offsets[first:last] - lo
+            starts[0] = 0
+            part = slice(first, last)
+            # fmin and fmax skip NaNs unless a group has nothing else.
+            if 'min' in aggregates:
+                low[part] = np.fmin(low[part],
+                                    np.fmin.reduceat(sorted_values, starts))
+            if 'max' in aggregates:
+                high[part] = np.fmax(high[part],
+                                     np.fmax.reduceat(sorted_values, starts))
+            missing = np.isnan(sorted_values)
+            sorted_values[missing] = 0
+            block_count = np.diff(starts, append=hi - lo) - \
+                np.add.reduceat(missing, starts, dtype=np.intp)
+            block_total = np.add.reduceat(sorted_values, starts)
+            if spread:
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    block_mean = np.nan_to_num(block_total / block_count)
+                    deviations = sorted_values - np.repeat(
+                        block_mean, np.diff(starts, append=hi - lo))
+                    deviations[missing] = 0
+                    delta = block_mean - np.nan_to_num(total[part] /
+                                                       count[part])
+                    merged = count[part] + block_count
+                    share = np.where(merged > 0, block_count / merged, 0)
+                    m2[part] += np.add.reduceat(deviations ** 2, starts) + \
+                        delta ** 2 * count[part] * share
+            count[part] += block_count
+            total[part] += block_total
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = total / count
+            var = m2 / (count - 1)
+        var[count < 2] = np.nan
+        return {'count': count, 'sum': total, 'mean': mean, 'min': low,
+                'max': high, 'var': var, 'std': np.sqrt(var)}
+
+    def agg(self, df, aggregates=('mean', 'min', 'max'), columns=None):
+        """
+        Returns the aggregates (from AGGREGATES) of the columns of df (by
+        default its numeric columns other than the keys) within each group,
+        laid out as df.groupby(by)[columns].agg(list(aggregates)) lays them
+        out, with a (column, aggregate) pair labelling each column.
+
+        Each column is sorted by group once, and all its aggregates come
+        from that one sorted copy.
+        """
+        unknown = set(aggregates) - set(AGGREGATES)
+        if unknown:
+            raise ValueError('unknown aggregates: {}'.format(
+                ', '.join(sorted(unknown))))
+        result = {}
+        for name in self._columns(df, columns):
+            column = df[name]
+            stats = self._aggregate(column.to_numpy(dtype=np.float64),
+                                    aggregates)
+            for aggregate in aggregates:
+                values = stats[aggregate]
+                if aggregate == 'count':
+                    values = values.astype(np.int64)
+                elif (aggregate in ('min', 'max', 'sum')
+                      and pd.api.types.is_integer_dtype(column)):
+                    values = values.astype(column.dtype)
+                result[(name, aggregate)] = values
+        return pd.DataFrame(result, index=self.groups)
+
+    def aggregates(self, df, aggregates=('mean', 'min', 'max'),
+                   columns=None):
+        """
+        Returns a dictionary from each of aggregates to the frame that
+        df.groupby(by)[columns] gives for it (for instance
+        df.groupby(by).mean() for 'mean'), computed in one pass.
+        """
+        table = self.agg(df, aggregates, columns)
+        return {aggregate: table.xs(aggregate, axis=1, level=1)
+                for aggregate in aggregates}
+
+    def mean(self, df, columns=None):
+        """
+        Returns the mean of the columns of df within each group.
+        """
+        return self.aggregates(df, ['mean'], columns)['mean']
+
+    def min(self, df, columns=None):
+        """
+        Returns the minimum of the columns of df within each group.
+        """
+        return self.aggregates(df, ['min'], columns)['min']
+
+    def max(self, df, columns=None):
+        """
+        Returns the maximum of the columns of df within each group.
+        """
+        return self.aggregates(df, ['max'], columns)['max']
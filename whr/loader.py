@@ -0,0 +1,408 @@
+"""
+Cached loading of the World Happiness Report workbook.
+
+Parsing the legacy WHR2018Chapter2OnlineData.xls workbook is by far the
+slowest step of the WHR exercises, and every notebook repeats it.  load_whr
+parses a worksheet once and stores it as one .npy file per column in a cache
+directory next to the workbook, so that later calls only have to read the
+column files back.
+
+The cache is keyed on the size, modification time and content hash of the
+workbook.  The hash is only recomputed when the size or modification time
+change, so a warm load does not have to read the workbook at all.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+
+WHR_FILE = 'WHR2018Chapter2OnlineData.xls'
+CACHE_DIRNAME = '.whr_cache'
+
+# The subset of Table2.1 used throughout the WHR exercises, and the shorter
+# names the exercises give those columns.
+COLS_TO_INCLUDE = ['country', 'year', 'Life Ladder',
+                   'Positive affect', 'Negative affect',
+                   'Log GDP per capita', 'Social support',
+                   'Healthy life expectancy at birth',
+                   'Freedom to make life choices',
+                   'Generosity', 'Perceptions of corruption']
+
+RENAMING = {'Life Ladder': 'Happiness',
+            'Log GDP per capita': 'LogGDP',
+            'Social support': 'Support',
+            'Healthy life expectancy at birth': 'Life',
+            'Freedom to make life choices': 'Freedom',
+            'Perceptions of corruption': 'Corruption',
+            'Positive affect': 'Positive',
+            'Negative affect': 'Negative'}
+
+# The indicators the regressions explain Happiness with, by their short
+# names.
+EXPLANATORY_VARS = ['LogGDP', 'Support', 'Life', 'Freedom', 'Generosity',
+                    'Corruption']
+
+
+def default_cache_dir(path):
+    """
+    Returns the cache directory used for the workbook at path, which is a
+    hidden directory next to the workbook.
+    """
+    return os.path.join(os.path.dirname(os.path.abspath(path)), CACHE_DIRNAME)
+
+
+def _read_json(path, default=None):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+def _write_json(path, obj):
+    # Write to a temporary file first so that a concurrent reader never sees
+    # a half-written file.
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix='.tmp-', suffix='.json')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(obj, f)
+    os.replace(tmp, path)
+
+
+def _hash_file(path, blocksize=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def workbook_key(path, cache_dir=None):
+    """
+    Returns the cache key of the workbook at path.
+
+    The key combines the file size and its SHA-256 content hash.  The hash of
+    each workbook is remembered in a manifest together with the size and
+    modification time it was computed for, and is only recomputed when either
+    of those has changed.
+    """
+    cache_dir = cache_dir or default_cache_dir(path)
+    stat = os.stat(path)
+    manifest_path = os.path.join(cache_dir, 'manifest.json')
+    manifest = _read_json(manifest_path, {})
+    name = os.path.abspath(path)
+    entry = manifest.get(name)
+    if (entry is None or entry['size'] != stat.st_size
+            or entry['mtime_ns'] != stat.st_mtime_ns):
+        entry = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                 'sha256': _hash_file(path)}
+        manifest[name] = entry
+        _write_json(manifest_path, manifest)
+    return '{}-{}'.format(entry['size'], entry['sha256'][:16])
+
+
+def _derived_dir(cache_dir, key, name):
+    return os.path.join(cache_dir, key, 'derived-' + name)
+
+
+def _sheet_dir(cache_dir, key, sheet_name):
+    # Sheet names may contain characters that are awkward in file names, so
+    # the directory is named after a hash of the sheet name.
+    tag = hashlib.sha1(str(sheet_name).encode('utf-8')).hexdigest()[:12]
+    return os.path.join(cache_dir, key, 'sheet-' + tag)
+
+
+def _column_entry(directory, filename, name, values):
+    """
+    Saves one column to directory and returns its description for the cache
+    metadata.  Text and categorical columns are stored as integer codes plus
+    an array of categories.
+    """
+    entry = {'name': name, 'file': filename}
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        np.save(os.path.join(directory, filename), values.cat.codes.to_numpy())
+        categories = values.cat.categories.to_numpy()
+        entry['kind'] = 'category'
+    elif values.dtype == object or pd.api.types.is_string_dtype(values.dtype):
+        codes, categories = pd.factorize(values)
+        np.save(os.path.join(directory, filename), codes.astype(np.int32))
+        categories = np.asarray(categories, dtype=object)
+        entry['kind'] = 'object'
+        entry['dtype'] = str(values.dtype)
+    else:
+        np.save(os.path.join(directory, filename), values.to_numpy())
+        return entry
+    entry['categories'] = 'cat_' + filename
+    np.save(os.path.join(directory, entry['categories']), categories,
+            allow_pickle=True)
+    return entry
+
+
+def _read_column(directory, entry, categorical=False):
+    values = np.load(os.path.join(directory, entry['file']))
+    kind = entry.get('kind')
+    if kind is None:
+        return values
+    categories = np.load(os.path.join(directory, entry['categories']),
+                         allow_pickle=True)
+    column = pd.Categorical.from_codes(values, categories)
+    if kind == 'object' and not categorical:
+        values = np.asarray(column, dtype=object)
+        if entry['dtype'] != 'object':
+            values = pd.array(values, dtype=entry['dtype'])
+        return values
+    return column
+
+
+def write_frame(directory, df, complete=True):
+    """
+    Stores the dataframe df in directory as one .npy file per column, and
+    replaces any frame previously stored there.  A non-default index is
+    stored as ordinary columns and restored by read_frame.
+
+    Pass complete=False when df only holds some of the columns of its
+    source, so that read_frame knows more columns may be added later.
+    """
+    index_names = None
+    if not isinstance(df.index, pd.RangeIndex) or df.index.name is not None:
+        index_names = list(df.index.names)
+        df = df.reset_index()
+    parent = os.path.dirname(directory)
+    os.makedirs(parent, exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=parent, prefix='.tmp-')
+    columns = []
+    for i, name in enumerate(df.columns):
+        filename = 'col_{:04d}.npy'.format(i)
+        columns.append(_column_entry(tmp, filename, name, df.iloc[:, i]))
+    meta = {'columns': columns, 'index': index_names, 'nrows': len(df),
+            'complete': complete}
+    with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+    if os.path.isdir(directory):
+        shutil.rmtree(directory)
+    os.replace(tmp, directory)
+
+
+def add_columns(directory, df):
+    """
+    Adds the columns of df to the frame stored in directory by write_frame.
+    Raises ValueError if df does not have the same number of rows as the
+    stored frame.
+    """
+    meta = _read_json(os.path.join(directory, 'meta.json'))
+    if len(df) != meta['nrows']:
+        raise ValueError('expected {} rows, got {}'.format(meta['nrows'],
+                                                           len(df)))
+    # The new column files are written before the metadata that refers to
+    # them, so readers only ever see columns that are fully stored.
+    start = len(meta['columns'])
+    for i, name in enumerate(df.columns, start):
+        filename = 'col_{:04d}.npy'.format(i)
+        meta['columns'].append(_column_entry(directory, filename, name,
+                                             df[name]))
+    _write_json(os.path.join(directory, 'meta.json'), meta)
+
+
+def read_frame(directory, columns=None, categorical=()):
+    """
+    Returns the dataframe stored in directory by write_frame, or None if
+    nothing has been stored there.  If columns is given, only those columns
+    are read, and None is returned if any of them is not stored.  Text
+    columns named in categorical are returned as categoricals, which avoids
+    decoding them only to encode them again.
+    """
+    meta = _read_json(os.path.join(directory, 'meta.json'))
+    if meta is None:
+        return None
+    entries = meta['columns']
+    if columns is None:
+        if not meta.get('complete', True):
+            return None
+    else:
+        by_name = {entry['name']: entry for entry in entries}
+        if any(name not in by_name for name in columns):
+            return None
+        entries = [by_name[name] for name in columns]
+    data = {entry['name']: _read_column(directory, entry,
+                                        entry['name'] in categorical)
+            for entry in entries}
+    df = pd.DataFrame(data, columns=[entry['name'] for entry in entries])
+    if meta['index'] is not None:
+        df = df.set_index(meta['index'])
+    return df
+
+
+def compact_dtypes(df, categorical=('country',), integer=('year',)):
+    """
+    Returns a copy of df with smaller dtypes: the columns named in
+    categorical become categoricals, those named in integer become int16,
+    and all other floating point columns become float32.
+
+    float32 keeps about 7 significant digits, which is ample for the WHR
+    indicators but means results can differ from float64 ones in the last
+    few decimal places.
+    """
+    dtypes = {}
+    for name in df.columns:
+        if name in categorical:
+            dtypes[name] = 'category'
+        elif name in integer:
+            dtypes[name] = np.int16
+        elif pd.api.types.is_float_dtype(df[name].dtype):
+            dtypes[name] = np.float32
+    return df.astype(dtypes)
+
+
+def memory_savings(df, dfraw):
+    """
+    Returns a series comparing the memory used by df with that used by
+    dfraw, in bytes, together with the fraction of memory saved.
+    """
+    used = df.memory_usage(deep=True).sum()
+    raw = dfraw.memory_usage(deep=True).sum()
+    return pd.Series({'dfraw': raw, 'df': used, 'saved': raw - used,
+                      'fraction saved': (raw - used) / raw})
+
+
+def _parse_sheet(path, sheet_name, directory, columns, refresh):
+    """
+    Parses the requested columns of a worksheet (all columns if columns is
+    None), stores them in the cache directory and returns them.  A cache
+    that held the whole sheet is parsed whole again, so that it stays
+    complete.
+    """
+    if columns is None:
+        df = pd.read_excel(path, sheet_name=sheet_name)
+        write_frame(directory, df)
+        return df
+    meta = _read_json(os.path.join(directory, 'meta.json'))
+    if meta is not None and not refresh:
+        cached = {entry['name'] for entry in meta['columns']}
+        missing = [name for name in columns if name not in cached]
+        new = pd.read_excel(path, sheet_name=sheet_name, usecols=missing)
+        if len(new) == meta['nrows']:
+            add_columns(directory, new)
+            return read_frame(directory, columns)
+    if meta is not None and meta.get('complete', True):
+        # The cache held the whole sheet; parse all of it again rather than
+        # replace it with just these columns.
+        df = pd.read_excel(path, sheet_name=sheet_name)
+        write_frame(directory, df)
+        return df[columns]
+    df = pd.read_excel(path, sheet_name=sheet_name, usecols=columns)
+    write_frame(directory, df, complete=False)
+    return df[columns]
+
+
+def load_whr(path=WHR_FILE, sheet_name='Table2.1', cache_dir=None,
+             refresh=False, columns=None, renaming=None, compact=False):
+    """
+    Returns the worksheet sheet_name of the WHR workbook at path as a
+    dataframe, exactly as pd.read_excel would.
+
+    The first call parses the workbook and stores the sheet in the columnar
+    cache; later calls read the cached columns instead.  Pass refresh=True to
+    force the workbook to be parsed again.
+
+    If columns is given, only those columns are parsed (or read from the
+    cache), in that order, so that
+
+        load_whr(columns=COLS_TO_INCLUDE, renaming=RENAMING)
+
+    returns the same dataframe as the exercises' dfraw[cols_to_include]
+    .rename(renaming, axis=1) without building dfraw.  With compact=True the
+    result is passed through compact_dtypes to save memory.
+    """
+    cache_dir = cache_dir or default_cache_dir(path)
+    directory = _sheet_dir(cache_dir, workbook_key(path, cache_dir),
+                           sheet_name)
+    renaming = renaming or {}
+    df = None
+    if not refresh:
+        # Text columns that compact_dtypes would turn into categoricals are
+        # read straight from their stored codes.
+        categorical = ()
+        if compact:
+            categorical = [name for name in columns or ['country']
+                           if renaming.get(name, name) == 'country']
+        df = read_frame(directory, columns, categorical)
+    if df is None:
+        df = _parse_sheet(path, sheet_name, directory, columns, refresh)
+    if renaming:
+        df = df.rename(renaming, axis=1)
+    if compact:
+        df = compact_dtypes(df)
+    return df
+
+
+def read_sheets(path, sheet_names, max_workers=None):
+    """
+    Returns a dictionary mapping each name in sheet_names to that worksheet
+    of the workbook at path.  The workbook is opened only once, and the
+    worksheets are parsed concurrently in a thread pool.
+    """
+    with pd.ExcelFile(path) as workbook:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = {name: pool.submit(workbook.parse, sheet_name=name)
+                       for name in sheet_names}
+            return {name: future.result() for name, future in futures.items()}
+
+
+def load_whr_sheets(path=WHR_FILE, sheet_names=('Table2.1',
+                                                'SupportingFactors'),
+                    cache_dir=None, refresh=False):
+    """
+    Returns a dictionary mapping each name in sheet_names to that worksheet
+    of the WHR workbook at path, like load_whr does for a single sheet.
+    Sheets that are not cached yet are parsed together by read_sheets.
+    """
+    cache_dir = cache_dir or default_cache_dir(path)
+    key = workbook_key(path, cache_dir)
+    directories = {name: _sheet_dir(cache_dir, key, name)
+                   for name in sheet_names}
+    sheets = {}
+    if not refresh:
+        for name, directory in directories.items():
+            df = read_frame(directory)
+            if df is not None:
+                sheets[name] = df
+    missing = [name for name in sheet_names if name not in sheets]
+    if missing:
+        for name, df in read_sheets(path, missing).items():
+            write_frame(directories[name], df)
+            sheets[name] = df
+    return {name: sheets[name] for name in sheet_names}
+
+
+def load_country_means(path=WHR_FILE, cache_dir=None, refresh=False):
+    """
+    Returns the dataframe df2 used by the clustering and classification
+    exercises: the mean of every indicator for each country, joined with
+    the country's region from the SupportingFactors sheet and indexed by
+    country.  The result is cached alongside the worksheets it is built
+    from.
+    """
+    cache_dir = cache_dir or default_cache_dir(path)
+    directory = _derived_dir(cache_dir, workbook_key(path, cache_dir), 'df2')
+    if not refresh:
+        df2 = read_frame(directory)
+        if df2 is not None:
+            return df2
+    sheets = load_whr_sheets(path, ('Table2.1', 'SupportingFactors'),
+                             cache_dir, refresh)
+    df = sheets['Table2.1'][COLS_TO_INCLUDE].rename(RENAMING, axis=1)
+    regions = sheets['SupportingFactors'][['country', 'Region indicator']]
+    regions = regions.rename({'Region indicator': 'region'}, axis=1)
+    dfmean = df.groupby('country').mean().drop('year', axis=1)
+    df2 = pd.merge(dfmean, regions, on='country').dropna()
+    df2 = df2.set_index('country')
+    write_frame(directory, df2)
+    return df2
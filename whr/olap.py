@@ -0,0 +1,279 @@
+"""
+A pre-aggregated cube of the WHR indicators for slice-and-dice queries.
+
+Dashboards built on the GroupingCuts and GroupingKeys exercises ask for the
+counts and means of the indicators by bins of Happiness, by deciles or
+quartiles of LogGDP, by year and by region, and by every combination of
+these, again and again.  OLAPCube aggregates the rows once into dense arrays
+indexed by the position of each row along every dimension (its bin, year
+or region), keeping the number of rows and the count, sum, minimum and
+maximum of every measure in each cell.  A query then only reduces those
+small arrays over the dimensions it rolls up, and new rows are added to
+the cells they fall in without going back to the rows already in the cube.
+"""
+
+import numpy as np
+import pandas as pd
+
+from .summary import _indicators
+
+
+STATISTICS = ('size', 'count', 'sum', 'mean', 'min', 'max')
+
+
+class OLAPCube:
+    """
+    The aggregates of the columns measures within every combination of the
+    dimensions, which map each dimension column to a Bins (to group its
+    values by bin) or to None (to group by its distinct values, as year or
+    region).  Rows that are missing a dimension or fall outside its bins are
+    left out of the cube, as df.groupby leaves out rows with missing keys.
+    """
+
+    def __init__(self, dimensions, measures):
+        self.dimensions = list(dimensions)
+        self.bins = dict(dimensions)
+        self.measures = list(measures)
+        self.labels = [self.bins[name].categories
+                       if self.bins[name] is not None else pd.Index([])
+                       for name in self.dimensions]
+        self._axes = {name: axis for axis, name in enumerate(self.dimensions)}
+        self._lookups = {}
+        self.n_rows = 0
+        self.n_dropped = 0
+        self._allocate([len(labels) for labels in self.labels])
+
+    def _allocate(self, shape):
+        shape = tuple(shape)
+        m = len(self.measures)
+        self.size = np.zeros(shape, dtype=np.int64)
+        self.count = np.zeros((m,) + shape, dtype=np.int64)
+        self.sum = np.zeros((m,) + shape)
+        self.min = np.full((m,) + shape, np.inf)
+        self.max = np.full((m,) + shape, -np.inf)
+
+    @classmethod
+    def from_frame(cls, df, dimensions, measures=None):
+        """
+        Returns the cube of the long-format dataframe df.  By default the
+        measures are the numeric columns of df other than the dimensions
+        grouped by distinct value (binned dimensions such as Happiness are
+        measures as well).
+        """
+        dimensions = dict(dimensions)
+        if measures is None:
+            measures = _indicators(df, [name for name, bins
+                                        in dimensions.items()
+                                        if bins is None])
+        return cls(dimensions, measures).update(df)
+
+    def _grow(self, axis, labels):
+        """
+        Adds the new labels to the axis of the dimension numbered axis,
+        keeping the labels sorted when they can be.
+        """
+        old = self.labels[axis]
+        merged = old.append(pd.Index(labels)).unique()
+        try:
+            merged = merged.sort_values()
+        except TypeError:
+            pass
+        positions = merged.get_indexer(old)
+        arrays = [self.size, self.count, self.sum, self.min, self.max]
+        self.labels[axis] = merged
+        shape = [len(labels) for labels in self.labels]
+        self._allocate(shape)
+        for new, previous in zip([self.size, self.count, self.sum, self.min,
+                                  self.max], arrays):
+            index = [slice(None)] * new.ndim
+            index[axis + new.ndim - len(shape)] = positions
+            new[tuple(index)] = previous
+
+    def _codes(self, df):
+        """
+        Returns the position of every row of df along every dimension, as an
+        array of shape (dimensions, rows), with -1 where it has none.
+        """
+        codes = np.empty((len(self.dimensions), len(df)), dtype=np.intp)
+        for axis, name in enumerate(self.dimensions):
+            bins = self.bins[name]
+            if bins is not None:
+                codes[axis] = bins.codes(df[name])
+                continue
+            values = df[name]
+            positions = self.labels[axis].get_indexer(values)
+            new = values[(positions < 0) & values.notna().to_numpy()]
+            if len(new):
+                self._grow(axis, pd.unique(new))
+                positions = self.labels[axis].get_indexer(values)
+            codes[axis] = positions
+        return codes
+
+    def update(self, df):
+        """
+        Adds the rows of the long-format dataframe df, for instance the rows
+        of a new edition, to the cube.  New years or regions extend the
+        cube; the bins of binned dimensions stay as they are.
+        """
+        codes = self._codes(df)
+        kept = (codes >= 0).all(axis=0)
+        cells = np.ravel_multi_index(codes[:, kept], self.size.shape)
+        n_cells = self.size.size
+        self.size += np.bincount(cells, minlength=n_cells).reshape(
+            self.size.shape)
+        for j, name in enumerate(self.measures):
+            values = df[name].to_numpy(dtype=np.float64)[kept]
+            present = ~np.isnan(values)
+            where, values = cells[present], values[present]
+            self.count[j] += np.bincount(where, minlength=n_cells).reshape(
+                self.size.shape)
+            self.sum[j] += np.bincount(where, weights=values,
+                                       minlength=n_cells).reshape(
+                                           self.size.shape)
+            np.minimum.at(self.min[j].reshape(-1), where, values)
+            np.maximum.at(self.max[j].reshape(-1), where, values)
+        self.n_rows += int(kept.sum())
+        self.n_dropped += int(len(kept) - kept.sum())
+        return self
+
+    def _selection(self, where):
+        """
+        Returns the positions along each axis selected by where, a
+        dictionary from dimensions to a label or a list of labels (for a
+        binned dimension, any value inside the bin will do).
+        """
+        selection = {}
+        for name, labels in (where or {}).items():
+            axis = self._axes[name]
+            if np.ndim(labels) == 0:
+                labels = [labels]
+            lookup = self._lookup(axis)
+            bins = self.bins[name]
+            positions = np.array(
+                [lookup.get(label, -1) if bins is None
+                 or isinstance(label, pd.Interval)
+                 else bins.codes([label])[0] for label in labels],
+                dtype=np.intp)
+            if (positions < 0).any():
+                raise KeyError('no {} {}'.format(
+                    name, [label for label, position in zip(labels, positions)
+                           if position < 0]))
+            selection[axis] = positions
+        return selection
+
+    def _lookup(self, axis):
+        # A dictionary from the labels of an axis to their positions, which
+        # is much faster than Index.get_indexer for a few labels.
+        labels = self.labels[axis]
+        if self._lookups.get(axis, (None,))[0] is not labels:
+            self._lookups[axis] = (labels, {label: position for position, label
+                                            in enumerate(labels)})
+        return self._lookups[axis][1]
+
+    def _rollup(self, array, statistic, selection, axes):
+        """
+        Returns the statistic ('sum', 'min' or 'max') of array over the
+        cells in selection, reduced over every dimension not in axes and
+        with the others in the order of axes.  The leading axes of array
+        that are not dimensions are kept.
+        """
+        lead = array.ndim - len(self.dimensions)
+        for axis, positions in selection.items():
+            array = np.take(array, positions, axis=lead + axis)
+        rolled = tuple(lead + axis for axis in range(len(self.dimensions))
+                       if axis not in axes)
+        if statistic == 'min':
+            array = array.min(axis=rolled, initial=np.inf)
+        elif statistic == 'max':
+            array = array.max(axis=rolled, initial=-np.inf)
+        else:
+            array = array.sum(axis=rolled)
+        # The remaining dimensions are in the order of the cube; put them
+        # in the order of axes.
+        order = list(range(lead)) + [lead + rank for rank in
+                                     np.argsort(np.argsort(axes))]
+        return np.transpose(array, order)
+
+    def _statistic(self, statistic, measures, selection, axes):
+        """
+        Returns the statistic of each of the measures (positions in
+        self.measures) as _rollup lays it out, with the measures first.
+        """
+        if statistic not in STATISTICS:
+            raise ValueError('unknown statistic: {}'.format(statistic))
+        if statistic == 'size':
+            return self._rollup(self.size, 'sum', selection, axes)
+        if statistic == 'mean':
+            with np.errstate(invalid='ignore', divide='ignore'):
+                return self._statistic('sum', measures, selection, axes) / \
+                    self._statistic('count', measures, selection, axes)
+        array = getattr(self, statistic)[measures]
+        array = self._rollup(array, statistic, selection, axes)
+        if statistic in ('min', 'max'):
+            array = np.where(np.isinf(array), np.nan, array)
+        return array
+
+    def aggregate(self, statistic, measure=None, by=(), where=None):
+        """
+        Returns the statistic (one of STATISTICS) of the measure within each
+        combination of the dimensions by, over the cells selected by where
+        (see query), as an array with one axis per dimension of by.  The
+        measure is not needed for 'size', the number of rows.
+        """
+        by = [by] if np.ndim(by) == 0 else list(by)
+        axes = [self._axes[name] for name in by]
+        measures = [] if statistic == 'size' else \
+            [self.measures.index(measure)]
+        array = self._statistic(statistic, measures, self._selection(where),
+                                axes)
+        return array if statistic == 'size' else array[0]
+
+    def query(self, by=(), statistics=('count', 'mean'), measures=None,
+              where=None, observed=False):
+        """
+        Returns the statistics of the measures (by default all of them)
+        within each combination of the dimensions by, as a dataframe with a
+        (measure, statistic) pair labelling each column, like
+        df.groupby(by).agg(list(statistics)) lays it out, and ('size', '')
+        labelling the number of rows if 'size' is one of statistics.
+        Leaving out a dimension rolls it up, and adding one drills down into
+        it.
+
+        where restricts the rows to the given labels of some dimensions,
+        such as {'year': [2015, 2016, 2017]}; for binned dimensions values
+        inside the bins may be given instead of the bins themselves.  Unless
+        observed is True, combinations with no rows are kept.
+        """
+        by = [by] if np.ndim(by) == 0 else list(by)
+        axes = [self._axes[name] for name in by]
+        measures = self.measures if measures is None else list(measures)
+        positions = [self.measures.index(name) for name in measures]
+        selection = self._selection(where)
+        levels = [self.labels[axis][selection[axis]] if axis in selection
+                  else self.labels[axis] for axis in axes]
+        if len(by) > 1:
+            # The levels are unique already, so the codes of their product
+            # can be laid out directly instead of factorizing the levels.
+            shape = [len(level) for level in levels]
+            codes = np.unravel_index(np.arange(int(np.prod(shape))), shape)
+            index = pd.MultiIndex(levels=levels, codes=codes, names=by,
+                                  verify_integrity=False)
+        elif by:
+            index = levels[0].rename(by[0])
+        else:
+            index = pd.RangeIndex(1)
+        # One roll-up of every measure for each statistic.
+        results = {statistic: self._statistic(statistic, positions,
+                                              selection, axes)
+                   for statistic in statistics if statistic != 'size'}
+        columns = {}
+        for k, name in enumerate(measures):
+            for statistic, array in results.items():
+                columns[(name, statistic)] = array[k].ravel()
+        size = self._statistic('size', [], selection, axes).ravel()
+        if 'size' in statistics:
+            columns[('size', '')] = size
+        table = pd.DataFrame(columns, index=index)
+        if observed:
+            table = table[size > 0]
+        return table
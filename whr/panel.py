@@ -0,0 +1,187 @@
+"""
+The WHR panel as a dense country x year x indicator cube.
+
+The exercises work with the long-format frame df (one row per country-year)
+and select year windows with boolean masks such as
+
+    df[df.year.isin(range(2015, 2018))]
+
+which scan every row and copy the result.  PanelCube stores the same data as
+a 3-D float array, with lookup tables from country, year and indicator
+labels to positions along each axis.  Year windows are then plain slices of
+the array, and the cube can be saved to disk and memory-mapped back.
+"""
+
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from .loader import (COLS_TO_INCLUDE, RENAMING, WHR_FILE, _derived_dir,
+                     default_cache_dir, load_whr, workbook_key)
+
+
+def _positions(labels, index):
+    """
+    Returns the positions of labels in index (a dictionary from labels to
+    positions) as a slice when they are consecutive and increasing, so that
+    indexing with the result gives a view rather than a copy.
+    """
+    positions = [index[label] for label in labels]
+    if positions and positions == list(range(positions[0],
+                                             positions[-1] + 1)):
+        return slice(positions[0], positions[-1] + 1)
+    return np.array(positions, dtype=np.intp)
+
+
+class PanelCube:
+    """
+    Holds a panel as an array values of shape (countries, years,
+    indicators).  Years run consecutively from first_year, and country-years
+    without data are NaN.
+    """
+
+    def __init__(self, values, countries, first_year, indicators,
+                 version=None):
+        self.values = values
+        self.countries = list(countries)
+        self.first_year = int(first_year)
+        self.indicators = list(indicators)
+        self.version = version
+        self.country_index = {name: i for i, name in enumerate(self.countries)}
+        self.indicator_index = {name: k
+                                for k, name in enumerate(self.indicators)}
+
+    @classmethod
+    def from_frame(cls, df, country='country', year='year', dtype=np.float64,
+                   version=None):
+        """
+        Returns a PanelCube built from the long-format dataframe df, with one
+        indicator for each column other than country and year.  Countries
+        are sorted alphabetically.  Rows missing their country or year are
+        left out, as df.groupby leaves them out.
+        """
+        codes, countries = pd.factorize(df[country], sort=True)
+        keep = (codes >= 0) & df[year].notna().to_numpy()
+        codes = codes[keep]
+        years = df[year].to_numpy()[keep].astype(np.int64)
+        first_year = years.min()
+        indicators = [name for name in df.columns
+                      if name not in (country, year)]
+        values = np.full((len(countries), years.max() - first_year + 1,
+                          len(indicators)), np.nan, dtype=dtype)
+        values[codes, years - first_year] = \
+            df[indicators].to_numpy(dtype)[keep]
+        return cls(values, countries, first_year, indicators, version)
+
+    @property
+    def years(self):
+        return list(range(self.first_year,
+                          self.first_year + self.values.shape[1]))
+
+    def year_slice(self, start, stop):
+        """
+        Returns the slice of the year axis covering the years start to stop,
+        both included.
+        """
+        n_years = self.values.shape[1]
+        first = min(max(start - self.first_year, 0), n_years)
+        last = min(max(stop - self.first_year + 1, first), n_years)
+        return slice(first, last)
+
+    def window(self, start, stop):
+        """
+        Returns a view of the cube for the years start to stop, both
+        included, without copying any data.
+        """
+        return self.values[:, self.year_slice(start, stop), :]
+
+    def select(self, countries=None, years=None, indicators=None):
+        """
+        Returns the part of the cube for the given countries, years and
+        indicators; None selects everything along that axis.  years is a
+        (start, stop) pair of years, both included.  The result is a view
+        whenever the countries and indicators are consecutive along their
+        axes, and a copy otherwise.
+        """
+        rows = slice(None)
+        if countries is not None:
+            rows = _positions(countries, self.country_index)
+        columns = slice(None)
+        if indicators is not None:
+            columns = _positions(indicators, self.indicator_index)
+        steps = slice(None)
+        if years is not None:
+            steps = self.year_slice(*years)
+        values = self.values[rows]
+        values = values[:, steps]
+        return values[:, :, columns]
+
+    def to_frame(self, years=None):
+        """
+        Returns the cube (or the (start, stop) window of years) as a
+        long-format dataframe like df, with one row for each country-year
+        that has at least one indicator.
+        """
+        steps = slice(None) if years is None else self.year_slice(*years)
+        values = self.values[:, steps]
+        present = ~np.isnan(values).all(axis=2)
+        rows, offsets = np.nonzero(present)
+        df = pd.DataFrame(values[rows, offsets], columns=self.indicators)
+        df.insert(0, 'country', np.asarray(self.countries, dtype=object)[rows])
+        first = self.first_year + (steps.start or 0)
+        df.insert(1, 'year', offsets + first)
+        return df
+
+    def save(self, directory):
+        """
+        Stores the cube in directory, replacing any cube stored there.
+        """
+        parent = os.path.dirname(os.path.abspath(directory))
+        os.makedirs(parent, exist_ok=True)
+        tmp = tempfile.mkdtemp(dir=parent, prefix='.tmp-')
+        np.save(os.path.join(tmp, 'values.npy'), self.values)
+        labels = {'countries': self.countries, 'first_year': self.first_year,
+                  'indicators': self.indicators, 'version': self.version}
+        with open(os.path.join(tmp, 'labels.json'), 'w') as f:
+            json.dump(labels, f)
+        if os.path.isdir(directory):
+            shutil.rmtree(directory)
+        os.replace(tmp, directory)
+
+    @classmethod
+    def open(cls, directory, mmap_mode='r'):
+        """
+        Returns the cube stored in directory by save, with its values
+        memory-mapped from disk, or None if no cube is stored there.
+        """
+        try:
+            with open(os.path.join(directory, 'labels.json')) as f:
+                labels = json.load(f)
+        except OSError:
+            return None
+        values = np.load(os.path.join(directory, 'values.npy'),
+                         mmap_mode=mmap_mode)
+        return cls(values, labels['countries'], labels['first_year'],
+                   labels['indicators'], labels['version'])
+
+
+def load_panel(path=WHR_FILE, cache_dir=None, refresh=False):
+    """
+    Returns the renamed WHR columns used by the exercises as a PanelCube
+    memory-mapped from the cache, building and storing it on first use.
+    """
+    cache_dir = cache_dir or default_cache_dir(path)
+    key = workbook_key(path, cache_dir)
+    directory = _derived_dir(cache_dir, key, 'panel')
+    if not refresh:
+        cube = PanelCube.open(directory)
+        if cube is not None:
+            return cube
+    df = load_whr(path, cache_dir=cache_dir, columns=COLS_TO_INCLUDE,
+                  renaming=RENAMING)
+    PanelCube.from_frame(df, version=key).save(directory)
+    return PanelCube.open(directory)
@@ -0,0 +1,337 @@
+"""
+Faceted plots of the WHR panel rendered in parallel.
+
+The PlotSummary exercise draws the Happiness of every country by year with
+
+    sns.catplot(x='year', y='Happiness', col='country', col_wrap=3,
+                kind='bar', height=2.0, aspect=2.5, color='b',
+                sharex=False, sharey=False)
+
+which lays out some 160 small axes in a single figure and draws them one
+after another in one process.  The facets do not depend on one another, so
+render_facets splits the grid into tiles of a few rows each and draws every
+tile in a worker process, on its own figure with the Agg canvas (neither
+pyplot nor an interactive backend is involved).  The tiles come back as
+RGBA arrays of the same width; stitch_tiles stacks them into the image of
+the whole grid, and save_facets writes it as one PNG or one page per tile.
+
+The pair plot of the same exercise, sns.pairplot(df, vars=plot_vars,
+hue='year', dropna=True), draws a marker for every row in every panel, so
+its cost and the size of its image grow with the number of rows.
+PairHistograms counts the rows of each panel into a 2-D histogram instead
+and draws it as one image, whose cost does not depend on the number of
+rows; the histograms are kept, so the plot can be drawn again without
+counting the rows again.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+import numpy as np
+import pandas as pd
+
+
+def _levels(values):
+    # The order seaborn gives the levels of a variable: the categories of a
+    # categorical, the sorted values of a numeric column and the values in
+    # order of appearance otherwise.
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return list(values.cat.categories)
+    levels = pd.unique(values.dropna())
+    if pd.api.types.is_numeric_dtype(values):
+        levels = np.sort(levels)
+    return list(levels)
+
+
+def _render_tile(facets, x, y, order, col_wrap, height, aspect, dpi,
+                 label_every, kwargs):
+    """
+    Returns the RGBA image of one tile of the grid, with a bar plot of y by
+    x for each (title, rows) pair of facets, col_wrap to a row.
+    """
+    import seaborn as sns
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    n_rows = -(-len(facets) // col_wrap)
+    figure = Figure(figsize=(col_wrap * height * aspect, n_rows * height),
+                    dpi=dpi)
+    canvas = FigureCanvasAgg(figure)
+    axes = figure.subplots(n_rows, col_wrap, squeeze=False).ravel()
+    labels = [str(level) if k % label_every == 0 else ' '
+              for k, level in enumerate(order)]
+    for ax, (title, rows) in zip(axes, facets):
+        sns.barplot(data=rows, x=x, y=y, order=order, ax=ax, **kwargs)
+        ax.set_title(title)
+        ax.set_xticks(range(len(order)))
+        ax.set_xticklabels(labels)
+    for ax in axes[len(facets):]:
+        ax.set_axis_off()
+    figure.tight_layout()
+    canvas.draw()
+    return np.asarray(canvas.buffer_rgba()).copy()
+
+
+def render_facets(df, x='year', y='Happiness', col='country', col_wrap=3,
+                  height=2.0, aspect=2.5, dpi=100, rows_per_tile=6,
+                  label_every=1, max_workers=None, **kwargs):
+    """
+    Returns the tiles of the grid of bar plots of y by x, one for each
+    value of col, as sns.catplot(x=x, y=y, col=col, col_wrap=col_wrap,
+    kind='bar', height=height, aspect=aspect, sharex=False, sharey=False)
+    draws them with the titles set to the values of col.  Every x axis has
+    all the values of x, labelled every label_every values (2 gives the
+    every-other-year labels of the exercise).  kwargs are passed on to
+    sns.barplot, for instance color='b'.
+
+    The tiles are RGBA arrays of rows_per_tile rows of the grid each (the
+    last may have fewer), drawn in parallel worker processes.
+    """
+    data = df[[col, x, y]]
+    order = _levels(data[x])
+    groups = dict(list(data.groupby(col, observed=True, sort=False)))
+    facets = [(str(name), groups.get(name, data.iloc[:0]))
+              for name in _levels(data[col])]
+    size = rows_per_tile * col_wrap
+    tiles = [facets[start:start + size]
+             for start in range(0, len(facets), size)]
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        return list(pool.map(_render_tile, tiles, repeat(x), repeat(y),
+                             repeat(order), repeat(col_wrap),
+                             repeat(height), repeat(aspect), repeat(dpi),
+                             repeat(label_every), repeat(kwargs)))
+
+
+def stitch_tiles(tiles):
+    """
+    Returns the image of the whole grid from its tiles, stacked from top to
+    bottom.
+    """
+    return np.concatenate(tiles, axis=0)
+
+
+def save_facets(df, path, paginate=False, **kwargs):
+    """
+    Renders the grid of bar plots of df with render_facets (which kwargs
+    are passed on to) and writes it as a PNG to path, and returns the list
+    of files written.  If paginate is True, each tile is written as a page
+    of its own to path.format(page), numbered from 1, so that path should
+    hold a placeholder such as 'happiness-{:02d}.png'.
+    """
+    from matplotlib.image import imsave
+
+    tiles = render_facets(df, **kwargs)
+    if not paginate:
+        imsave(path, stitch_tiles(tiles))
+        return [path]
+    paths = []
+    for page, tile in enumerate(tiles, 1):
+        paths.append(path.format(page))
+        imsave(paths[-1], tile)
+    return paths
+
+
+class PairHistograms:
+    """
+    The histograms behind a density version of the pair plot of the
+    PlotSummary exercise, sns.pairplot(df, vars=vars, hue=hue, dropna=True):
+    a histogram of each of vars over bins equal bins spanning its values,
+    and a 2-D histogram of each pair of them over the same bins.  With a
+    hue column, the mean of hue within each cell of the 2-D histograms is
+    kept as well.  Like dropna=True, each panel only counts the rows where
+    both its variables (and hue) are present; the variables with no values
+    at all are listed in empty, and their panels are left blank.
+
+    The bin of every row is found once for each variable, and each 2-D
+    histogram is computed the first time it is asked for, from the bins of
+    its two variables, and kept for later plots.  The histogram of (y, x)
+    is the transpose of that of (x, y).
+    """
+
+    def __init__(self, df, vars, hue=None, bins=50):
+        self.vars = list(vars)
+        self.hue = hue
+        self.bins = bins
+        columns = self.vars + ([hue] if hue is not None else [])
+        self.values = df[columns].to_numpy(dtype=np.float64)
+        self.edges = {}
+        self.empty = []
+        self._codes = {}
+        for j, name in enumerate(self.vars):
+            column = self.values[:, j]
+            present = column[~np.isnan(column)]
+            if len(present):
+                low, high = present.min(), present.max()
+            else:
+                # A variable with no values is binned over [0, 1], and its
+                # panels are left empty.
+                low, high = 0.0, 1.0
+                self.empty.append(name)
+            if low == high:
+                low, high = low - 0.5, high + 0.5
+            edges = np.linspace(low, high, bins + 1)
+            # The bin of each value as np.histogram2d finds it, with the
+            # last bin closed on the right, and -1 for missing values.
+            codes = np.searchsorted(edges, column, side='right') - 1
+            codes[column == high] = bins - 1
+            codes[np.isnan(column)] = -1
+            if hue is not None:
+                codes[np.isnan(self.values[:, -1])] = -1
+            self.edges[name] = edges
+            self._codes[name] = codes
+        self._counts = {}
+        self._means = {}
+
+    def histogram(self, x):
+        """
+        Returns the number of rows in each bin of x.
+        """
+        codes = self._codes[x]
+        return np.bincount(codes[codes >= 0], minlength=self.bins)
+
+    def _pair(self, x, y):
+        # The cell of each row in the 2-D histogram of (x, y), and which
+        # rows have one.
+        cells = self._codes[x] * self.bins + self._codes[y]
+        present = (self._codes[x] >= 0) & (self._codes[y] >= 0)
+        return cells[present], present
+
+    def counts(self, x, y):
+        """
+        Returns the 2-D histogram of x and y, as np.histogram2d(df[x],
+        df[y], bins=[self.edges[x], self.edges[y]]) computes it over the
+        rows where both are present, with x along the first axis.
+        """
+        if (y, x) in self._counts:
+            return self._counts[(y, x)].T
+        if (x, y) not in self._counts:
+            cells, _ = self._pair(x, y)
+            self._counts[(x, y)] = np.bincount(
+                cells, minlength=self.bins ** 2).reshape(self.bins,
+                                                         self.bins)
+        return self._counts[(x, y)]
+
+    def means(self, x, y):
+        """
+        Returns the mean of hue within each cell of the 2-D histogram of x
+        and y, and NaN in empty cells.
+        """
+        if self.hue is None:
+            raise ValueError('the histograms have no hue')
+        if (y, x) in self._means:
+            return self._means[(y, x)].T
+        if (x, y) not in self._means:
+            cells, present = self._pair(x, y)
+            totals = np.bincount(cells, weights=self.values[present, -1],
+                                 minlength=self.bins ** 2)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                self._means[(x, y)] = totals.reshape(
+                    self.bins, self.bins) / self.counts(x, y)
+        return self._means[(x, y)]
+
+    def sample(self, n_points, seed=0):
+        """
+        Returns the values of vars (and hue) of at most n_points rows drawn
+        at random without replacement, the same rows for every panel.
+        """
+        n_rows = len(self.values)
+        if n_rows <= n_points:
+            return self.values
+        rows = np.random.default_rng(seed).choice(n_rows, n_points,
+                                                  replace=False)
+        return self.values[np.sort(rows)]
+
+    def plot(self, kind='density', n_points=5000, seed=0, cmap='Blues',
+             height=2.5):
+        """
+        Returns the figure of the pair plot: the histograms of vars on the
+        diagonal and their pairs off it, as images of the number of rows in
+        each cell (on a log scale) or, with a hue column, of the mean of hue
+        in each cell, with a colorbar.
+
+        The panels of a pair with at most n_points rows are drawn as points
+        instead, since their images would be mostly empty cells.  With
+        kind='scatter' every panel is drawn as points, from a sample of
+        n_points rows (see sample).
+        """
+        import matplotlib.pyplot as plt
+        from matplotlib.cm import ScalarMappable
+        from matplotlib.colors import LogNorm, Normalize
+
+        if kind not in ('density', 'scatter'):
+            raise ValueError('unknown kind: {}'.format(kind))
+        size = len(self.vars)
+        figure, axes = plt.subplots(size, size, squeeze=False,
+                                    figsize=(size * height, size * height))
+        color = plt.get_cmap(cmap)(0.7)
+        if self.hue is not None:
+            hues = self.values[:, -1]
+            hues = hues[~np.isnan(hues)]
+            norm = Normalize(hues.min(), hues.max()) if len(hues) else \
+                Normalize(0, 1)
+        else:
+            norm = LogNorm(1, max(len(self.values), 2))
+        points = self.sample(n_points, seed) if kind == 'scatter' else \
+            self.values
+        colorbar = self.hue is not None
+        for i, y in enumerate(self.vars):
+            for j, x in enumerate(self.vars):
+                ax = axes[i, j]
+                xedges, yedges = self.edges[x], self.edges[y]
+                if x in self.empty or y in self.empty:
+                    pass
+                elif i == j:
+                    ax.stairs(self.histogram(x), xedges, fill=True,
+                              color=color)
+                    ax.set_yticks([])
+                elif kind == 'scatter' or \
+                        self.counts(x, y).sum() <= n_points:
+                    keep = ~np.isnan(points[:, [j, i]]).any(axis=1)
+                    if self.hue is None:
+                        ax.scatter(points[keep, j], points[keep, i], s=4,
+                                   color=color, rasterized=True)
+                    else:
+                        keep &= ~np.isnan(points[:, -1])
+                        ax.scatter(points[keep, j], points[keep, i], s=4,
+                                   c=points[keep, -1], cmap=cmap, norm=norm,
+                                   rasterized=True)
+                else:
+                    if self.hue is not None:
+                        image = np.ma.masked_invalid(self.means(x, y))
+                    else:
+                        image = np.ma.masked_equal(self.counts(x, y), 0)
+                        colorbar = True
+                    # The histograms have x along their first axis, and
+                    # imshow draws the first axis of an image vertically.
+                    ax.imshow(image.T, origin='lower', cmap=cmap, norm=norm,
+                              aspect='auto', interpolation='nearest',
+                              extent=(xedges[0], xedges[-1], yedges[0],
+                                      yedges[-1]))
+                ax.set_xlim(xedges[0], xedges[-1])
+                if i != j:
+                    ax.set_ylim(yedges[0], yedges[-1])
+                if i == size - 1:
+                    ax.set_xlabel(x)
+                else:
+                    ax.set_xticklabels([])
+                if j == 0:
+                    ax.set_ylabel(y)
+                elif i != j:
+                    ax.set_yticklabels([])
+        figure.tight_layout()
+        if colorbar:
+            figure.colorbar(ScalarMappable(norm, cmap),
+                            ax=axes.ravel().tolist(), shrink=0.5,
+                            label=self.hue if self.hue is not None
+                            else 'rows')
+        return figure
+
+
+def pairplot_density(df, vars, hue=None, bins=50, **kwargs):
+    """
+    Returns the figure of the density version of sns.pairplot(df,
+    vars=vars, hue=hue, dropna=True), drawn by PairHistograms.plot with the
+    keyword arguments kwargs.  Keep a PairHistograms instead to draw the
+    plot again without counting the rows again.
+    """
+    return PairHistograms(df, vars, hue, bins).plot(**kwargs)
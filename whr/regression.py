@@ -0,0 +1,711 @@
+"""
+Ordinary least squares fits of Happiness on the WHR explanatory variables.
+
+The Regression exercise fits sm.OLS(Y, X, missing='drop') one model at a
+time.  Everything a least squares fit needs is in the Gram matrix of the
+constant, the explanatory variables and the response:
+
+    [1 X y]' [1 X y]
+
+and the Gram matrix of any subset of the variables is a sub-block of it.
+With missing='drop' each model only uses the rows where its own variables
+are present, so the Gram matrix is accumulated separately for each pattern
+of missing values, and the matrix of a model is the sum over the patterns
+in which all its variables are present.
+
+The columns are shifted by their means before the products are formed, to
+keep the sums well conditioned; the intercept and its standard error are
+shifted back afterwards.
+
+StreamingOLS fits a single model to data that does not fit in memory.  It
+keeps the triangular factor R of the QR decomposition of the rows of
+[1 X y] seen so far, which is updated by decomposing R stacked on each new
+chunk (as in TSQR), so that R never has more than one row per column.
+Factors computed from separate chunks or processes merge the same way.
+
+Both fit_ols and StreamingOLS.fit give an OLSResult, a compact result that
+only computes the diagnostics that are asked for.
+
+ridge_path and elastic_net_path compute penalized fits for many penalties
+at once, from one decomposition of the standardized design matrix.
+
+fixed_effects_ols fits the panel with country (and year) effects by
+subtracting group means instead of adding a dummy column per country.
+"""
+
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from itertools import combinations
+from math import comb
+
+import numpy as np
+import pandas as pd
+
+from .correlation import _column_means
+from .loader import EXPLANATORY_VARS
+
+
+def _pattern_grams(values):
+    """
+    Returns the distinct patterns of present values of the rows of values
+    (as boolean rows) and the Gram matrix of [1 values] over the rows of
+    each pattern, with missing values set to zero, and the column means
+    that values were shifted by.
+    """
+    present = ~np.isnan(values)
+    # Each pattern as an integer, one bit per column.
+    bits = present @ (1 << np.arange(values.shape[1]))
+    keys, codes = np.unique(bits, return_inverse=True)
+    codes = codes.ravel()
+    patterns = (keys[:, None] >> np.arange(values.shape[1])) & 1 == 1
+    shift = _column_means(values)
+    augmented = np.column_stack([np.ones(len(values)),
+                                 np.where(present, values - shift, 0)])
+    order = np.argsort(codes, kind='stable')
+    counts = np.bincount(codes, minlength=len(patterns))
+    ends = np.cumsum(counts)
+    grams = np.empty((len(patterns),) + (augmented.shape[1],) * 2)
+    for k, (start, end) in enumerate(zip(ends - counts, ends)):
+        rows = augmented[order[start:end]]
+        grams[k] = rows.T @ rows
+    return patterns, grams, shift
+
+
+def _fit_subsets(gram, subsets, shift):
+    """
+    Returns the fits of the subsets (tuples of column positions, all of
+    the same length) from their Gram matrices gram, whose first row and
+    column belong to the constant and last to the response, as a
+    dictionary of arrays with one entry per subset.
+    """
+    # Positions in the Gram matrix: the constant, the subset, the response.
+    index = np.array([[0] + [1 + j for j in subset] for subset in subsets])
+    rows = np.arange(len(subsets))[:, None, None]
+    xtx = gram[rows, index[:, :, None], index[:, None, :]]
+    xty = gram[rows[:, :, 0], index, -1]
+    yty = gram[:, -1, -1]
+    nobs = gram[:, 0, 0]
+    k = index.shape[1]
+    # A subset with too few rows or collinear variables (such as one that
+    # is never present) has no fit; its row is left NaN.
+    solvable = (nobs > k) & (np.linalg.matrix_rank(xtx) == k)
+    inverse = np.full(xtx.shape, np.nan)
+    if solvable.any():
+        inverse[solvable] = np.linalg.inv(xtx[solvable])
+    params = np.einsum('sij,sj->si', inverse, xty)
+    ssr = yty - np.einsum('si,si->s', params, xty)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        centered_tss = yty - gram[:, 0, -1] ** 2 / nobs
+        df_resid = nobs - k
+        scale = ssr / df_resid
+    # The intercept of the unshifted data is params[0] + shift[y] minus
+    # the slopes times the shifts of their variables.
+    weights = np.column_stack([np.ones(len(subsets)),
+                               -shift[index[:, 1:] - 1]])
+    params[:, 0] += shift[-1] + np.einsum('si,si->s', params[:, 1:],
+                                          weights[:, 1:])
+    variances = np.einsum('sii->si', inverse).copy()
+    variances[:, 0] = np.einsum('si,sij,sj->s', weights, inverse, weights)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        llf = -nobs / 2 * (np.log(2 * np.pi) + np.log(ssr / nobs) + 1)
+        rsquared = 1 - ssr / centered_tss
+        return {
+            'params': params,
+            'bse': np.sqrt(variances * scale[:, None]),
+            'nobs': nobs,
+            'rsquared': rsquared,
+            'rsquared_adj': 1 - (nobs - 1) / df_resid * (1 - rsquared),
+            'aic': -2 * llf + 2 * k,
+            'bic': -2 * llf + np.log(nobs) * k,
+        }
+
+
+def all_subsets_ols(df, y='Happiness', x=EXPLANATORY_VARS):
+    """
+    Returns the OLS fits of y on a constant and every non-empty subset of
+    the columns x of df (63 models for the six explanatory variables), each
+    as sm.OLS(df[y], sm.add_constant(df[subset]), missing='drop').fit()
+    would give it.
+
+    The result has one row per subset, labelled like 'LogGDP + Support',
+    with the columns nobs, rsquared, rsquared_adj, aic and bic, and the
+    coefficients and their standard errors under params and bse (NaN for
+    the variables a model leaves out).  result['aic'].idxmin() names the
+    model with the lowest AIC.
+    """
+    x = list(x)
+    values = df[x + [y]].to_numpy(dtype=np.float64)
+    patterns, grams, shift = _pattern_grams(values)
+    subsets = [subset for size in range(1, len(x) + 1)
+               for subset in combinations(range(len(x)), size)]
+    # Each subset sums the Gram matrices of the patterns in which y and all
+    # of its variables are present.
+    needed = np.zeros((len(subsets), len(x) + 1), dtype=bool)
+    needed[:, -1] = True
+    for s, subset in enumerate(subsets):
+        needed[s, list(subset)] = True
+    covers = (patterns[None, :, :] | ~needed[:, None, :]).all(axis=2)
+    gram = (covers.astype(np.float64) @
+            grams.reshape(len(patterns), -1)).reshape(
+                (len(subsets),) + grams.shape[1:])
+
+    names = ['const'] + x
+    table = {name: np.full(len(subsets), np.nan)
+             for name in ['nobs', 'rsquared', 'rsquared_adj', 'aic', 'bic']}
+    params = np.full((len(subsets), len(names)), np.nan)
+    bse = np.full((len(subsets), len(names)), np.nan)
+    first = 0
+    for size in range(1, len(x) + 1):
+        stop = first + comb(len(x), size)
+        fit = _fit_subsets(gram[first:stop], subsets[first:stop], shift)
+        for name in table:
+            table[name][first:stop] = fit[name]
+        columns = np.array([[0] + [1 + j for j in subset]
+                            for subset in subsets[first:stop]])
+        rows = np.arange(first, stop)[:, None]
+        params[rows, columns] = fit['params']
+        bse[rows, columns] = fit['bse']
+        first = stop
+
+    index = pd.Index([' + '.join(x[j] for j in subset)
+                      for subset in subsets], name='model')
+    result = pd.DataFrame(table, index=index)
+    result['nobs'] = result['nobs'].round().astype(int)
+    result.columns = pd.MultiIndex.from_product([result.columns, ['']])
+    return pd.concat([
+        result,
+        pd.DataFrame(params, index=index,
+                     columns=pd.MultiIndex.from_product([['params'], names])),
+        pd.DataFrame(bse, index=index,
+                     columns=pd.MultiIndex.from_product([['bse'], names])),
+    ], axis=1)
+
+
+def grouped_ols(df, by='country', y='Happiness', x=('LogGDP',)):
+    """
+    Returns the OLS fit of y on a constant and the columns x within each
+    group of the rows of df by the column by, as
+
+        sm.OLS(group[y], sm.add_constant(group[x]), missing='drop').fit()
+
+    would give it for every group at once: per-country Happiness~LogGDP
+    slopes with by='country', or per-year fits of all the explanatory
+    variables with by='year' and x=EXPLANATORY_VARS.
+
+    The result is a tidy table indexed by group and term (const and the
+    columns x) with the columns coef, bse and nobs.  Groups with too few
+    rows, or whose variables are collinear, have NaN coefficients.
+
+    The rows are sorted by group once, and the normal equations of every
+    group are accumulated with segmented sums over the sorted rows, after
+    centering each group on its means.  All the groups are then solved in
+    one batched np.linalg.solve.
+    """
+    x = list(x)
+    values = df[x + [y]].to_numpy(dtype=np.float64)
+    codes, groups = pd.factorize(df[by], sort=True)
+    keep = (codes >= 0) & ~np.isnan(values).any(axis=1)
+    codes = codes[keep]
+    order = np.argsort(codes, kind='stable')
+    codes = codes[order]
+    # Variables along the first axis, so that each segmented sum runs over
+    # contiguous memory.
+    values = values[keep][order].T
+    counts = np.bincount(codes, minlength=len(groups))
+    filled = np.flatnonzero(counts)
+    starts = (np.cumsum(counts) - counts)[filled]
+    nobs = counts[filled].astype(np.float64)
+
+    means = np.add.reduceat(values, starts, axis=1) / nobs
+    centered = values - np.repeat(means, counts[filled], axis=1)
+    k = len(x) + 1
+    cross = np.empty((len(filled), k, k))
+    for j in range(k):
+        for l in range(j, k):
+            cross[:, j, l] = cross[:, l, j] = np.add.reduceat(
+                centered[j] * centered[l], starts)
+
+    xtx = cross[:, :-1, :-1]
+    solvable = (nobs > k) & (np.linalg.matrix_rank(xtx) == len(x))
+    slopes = np.full((len(filled), len(x)), np.nan)
+    inverse = np.full((len(filled), len(x), len(x)), np.nan)
+    if solvable.any():
+        system = xtx[solvable]
+        identity = np.broadcast_to(np.eye(len(x)), system.shape)
+        solved = np.linalg.solve(system, np.concatenate(
+            [cross[solvable, :-1, -1:], identity], axis=2))
+        slopes[solvable] = solved[:, :, 0]
+        inverse[solvable] = solved[:, :, 1:]
+    ssr = cross[:, -1, -1] - np.einsum('gi,gi->g', slopes, cross[:, :-1, -1])
+    scale = ssr / (nobs - k)
+    x_means = means[:-1].T
+    intercept = means[-1] - np.einsum('gi,gi->g', slopes, x_means)
+    intercept_variance = scale * (1 / nobs + np.einsum(
+        'gi,gij,gj->g', x_means, inverse, x_means))
+    slope_variance = np.einsum('gii->gi', inverse) * scale[:, None]
+
+    coef = np.column_stack([intercept, slopes])
+    bse = np.sqrt(np.column_stack([intercept_variance, slope_variance]))
+    index = pd.MultiIndex.from_product([groups[filled], ['const'] + x],
+                                       names=[by, 'term'])
+    return pd.DataFrame({'coef': coef.ravel(), 'bse': bse.ravel(),
+                         'nobs': np.repeat(counts[filled], k)}, index=index)
+
+
+class OLSResult:
+    """
+    The coefficients and diagnostics of an OLS fit, computed from the
+    triangular factor r of the QR decomposition of [X y] over nobs rows.
+    tss is the total sum of squares of y (about its mean when X has a
+    constant) and names names the columns of X.
+
+    A ValueError is raised if X is rank deficient, rather than returning
+    the arbitrary coefficients of a singular factor.
+
+    Only the coefficients are computed up front.  Standard errors,
+    p-values and the other diagnostics are computed on first use and then
+    kept, as is the inverse of the factor of X, from which the covariance
+    of the coefficients and the standard errors of predictions follow.
+    """
+
+    __slots__ = ('names', 'nobs', 'df_resid', 'ssr', 'tss', '_r', '_params',
+                 '_inverse', '_bse', '_pvalues')
+
+    def __init__(self, r, nobs, tss, names):
+        k = len(names)
+        if nobs <= k:
+            raise ValueError('{} rows are too few to fit {} '
+                             'parameters'.format(nobs, k))
+        self.names = list(names)
+        self.nobs = nobs
+        self.df_resid = nobs - k
+        # The last column of r holds Q'y, and its last row the square root
+        # of the residual sum of squares.
+        self.ssr = r[k, k] ** 2 if len(r) > k else 0.0
+        self.tss = tss
+        self._r = r[:k, :k]
+        # The diagonal of r is the part of each column of X not explained
+        # by the columns before it; next to the norm of the column, it
+        # vanishes for a column that is collinear with those.
+        norms = np.linalg.norm(self._r, axis=0)
+        collinear = np.abs(np.diag(self._r)) <= 1e-10 * norms
+        if collinear.any():
+            raise ValueError('exog is rank deficient, columns collinear '
+                             'with the ones before: {}'.format(', '.join(
+                                 str(name) for name, flag
+                                 in zip(self.names, collinear) if flag)))
+        self._params = np.linalg.solve(self._r, r[:k, k])
+        self._inverse = None
+        self._bse = None
+        self._pvalues = None
+
+    @property
+    def params(self):
+        """
+        The coefficients, as an array in the order of names.
+        """
+        return self._params
+
+    @property
+    def scale(self):
+        """
+        The estimated variance of the residuals.
+        """
+        return self.ssr / self.df_resid
+
+    def _unscaled(self):
+        # The inverse of the factor of X, so that (X'X)^-1 = inverse
+        # inverse'.
+        if self._inverse is None:
+            self._inverse = np.linalg.inv(self._r)
+        return self._inverse
+
+    def cov_params(self):
+        """
+        Returns the covariance matrix of the coefficients.
+        """
+        inverse = self._unscaled()
+        return inverse @ inverse.T * self.scale
+
+    @property
+    def bse(self):
+        """
+        The standard errors of the coefficients.
+        """
+        if self._bse is None:
+            self._bse = np.sqrt((self._unscaled() ** 2).sum(axis=1) *
+                                self.scale)
+        return self._bse
+
+    @property
+    def tvalues(self):
+        """
+        The t statistics of the coefficients.
+        """
+        return self._params / self.bse
+
+    @property
+    def pvalues(self):
+        """
+        The two-sided p-values of the t statistics.
+        """
+        if self._pvalues is None:
+            from scipy.special import stdtr
+            self._pvalues = 2 * stdtr(self.df_resid, -np.abs(self.tvalues))
+        return self._pvalues
+
+    @property
+    def rsquared(self):
+        """
+        The coefficient of determination.
+        """
+        return 1 - self.ssr / self.tss
+
+    @property
+    def rsquared_adj(self):
+        """
+        The coefficient of determination adjusted for the number of
+        coefficients.
+        """
+        return 1 - (self.nobs - 1) / self.df_resid * (1 - self.rsquared)
+
+    def predict(self, exog):
+        """
+        Returns the predictions for the rows of exog (with the columns of X,
+        the constant included) and their standard errors, as the columns
+        mean and mean_se of a dataframe.
+        """
+        index = getattr(exog, 'index', None)
+        exog = np.asarray(exog, dtype=np.float64).reshape(-1, len(self.names))
+        mean_se = np.sqrt(((exog @ self._unscaled()) ** 2).sum(axis=1) *
+                          self.scale)
+        return pd.DataFrame({'mean': exog @ self._params,
+                             'mean_se': mean_se}, index=index)
+
+    def to_frame(self):
+        """
+        Returns the coefficients, standard errors, t statistics and p-values
+        as a dataframe with one row per coefficient.
+        """
+        return pd.DataFrame({'coef': self._params, 'bse': self.bse,
+                             't': self.tvalues, 'pvalue': self.pvalues},
+                            index=self.names)
+
+
+def fit_ols(endog, exog):
+    """
+    Returns the OLSResult of the regression of endog on exog, as
+    sm.OLS(endog, exog, missing='drop').fit() computes it: rows in which
+    any value is missing are dropped, and exog must include the constant
+    (sm.add_constant adds it).
+    """
+    names = list(getattr(exog, 'columns', []))
+    data = np.column_stack([np.asarray(exog, dtype=np.float64),
+                            np.asarray(endog, dtype=np.float64)])
+    data = data[~np.isnan(data).any(axis=1)]
+    if not names:
+        names = ['x{}'.format(j + 1) for j in range(data.shape[1] - 1)]
+    y = data[:, -1]
+    # R-squared is centered when X has a constant column, as in statsmodels.
+    tss = (y ** 2).sum()
+    if len(data) and ((np.ptp(data[:, :-1], axis=0) == 0) &
+                      (data[0, :-1] != 0)).any():
+        tss = ((y - y.mean()) ** 2).sum()
+    return OLSResult(np.linalg.qr(data, mode='r'), len(data), tss, names)
+
+
+class StreamingOLS:
+    """
+    The running fit of y on a constant and the columns x, as
+    sm.OLS(df[y], sm.add_constant(df[x]), missing='drop').fit() gives it,
+    for data added one chunk of rows at a time.  Fits of separate chunks,
+    for instance computed by worker processes, can be merged.
+    """
+
+    def __init__(self, y='Happiness', x=EXPLANATORY_VARS):
+        self.y = y
+        self.x = list(x)
+        # R of [1 X y]: its last column holds Q'y and, in the last row, the
+        # square root of the residual sum of squares.
+        self.r = np.zeros((0, len(self.x) + 2))
+        # The count, mean and sum of squared deviations of y, for R-squared.
+        self.nobs = 0
+        self.y_mean = 0.0
+        self.y_m2 = 0.0
+
+    def _absorb(self, rows, nobs, y_mean, y_m2):
+        self.r = np.linalg.qr(np.concatenate([self.r, rows]), mode='r')
+        total = self.nobs + nobs
+        if total:
+            delta = y_mean - self.y_mean
+            self.y_m2 += y_m2 + delta ** 2 * self.nobs * nobs / total
+            self.y_mean += delta * nobs / total
+        self.nobs = total
+
+    def update(self, chunk):
+        """
+        Adds the rows of the dataframe chunk, dropping those in which y or
+        any of x is missing.
+        """
+        values = chunk[self.x + [self.y]].to_numpy(dtype=np.float64)
+        values = values[~np.isnan(values).any(axis=1)]
+        y = values[:, -1]
+        mean = y.mean() if len(y) else 0.0
+        rows = np.column_stack([np.ones(len(values)), values])
+        self._absorb(rows, len(y), mean, ((y - mean) ** 2).sum())
+        return self
+
+    def merge(self, other):
+        """
+        Adds the rows fitted by other, which must be over the same columns.
+        """
+        if other.y != self.y or other.x != self.x:
+            raise ValueError('cannot merge fits of different columns')
+        self._absorb(other.r, other.nobs, other.y_mean, other.y_m2)
+        return self
+
+    def fit(self):
+        """
+        Returns the OLSResult of the rows added so far.
+        """
+        k = len(self.x) + 1
+        return OLSResult(self.r[:k + 1, :], self.nobs, self.y_m2,
+                         ['const'] + self.x)
+
+
+def ols_csv(path, y='Happiness', x=EXPLANATORY_VARS, chunksize=10**6,
+            **kwargs):
+    """
+    Returns the StreamingOLS fit of the CSV file at path, read chunksize
+    rows at a time.  Further keyword arguments are passed to pd.read_csv.
+    """
+    fit = StreamingOLS(y, x)
+    kwargs['usecols'] = fit.x + [fit.y]
+    for chunk in pd.read_csv(path, chunksize=chunksize, **kwargs):
+        fit.update(chunk)
+    return fit
+
+
+def ols_csvs(paths, y='Happiness', x=EXPLANATORY_VARS, chunksize=10**6,
+             max_workers=None, **kwargs):
+    """
+    Returns the StreamingOLS fit of all the CSV files in paths, which are
+    fitted by ols_csv in parallel worker processes.
+    """
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = [pool.submit(ols_csv, path, y, x, chunksize, **kwargs)
+                   for path in paths]
+        fits = [future.result() for future in futures]
+    fit = fits[0]
+    for other in fits[1:]:
+        fit.merge(other)
+    return fit
+
+
+def _standardized(df, y, x):
+    """
+    Returns the rows of df[x] and df[y] with no missing values, with x
+    centered and scaled to unit variance and y centered, together with
+    the means and scales of x and the mean of y.
+    """
+    values = df[x + [y]].to_numpy(dtype=np.float64)
+    values = values[~np.isnan(values).any(axis=1)]
+    means = values.mean(axis=0)
+    scales = values[:, :-1].std(axis=0)
+    scales[scales == 0] = 1
+    design = (values[:, :-1] - means[:-1]) / scales
+    return design, values[:, -1] - means[-1], means[:-1], scales, means[-1]
+
+
+def _path_frame(alphas, coef, x_means, scales, y_mean, x, **columns):
+    # The coefficients on the original scale of x, in the layout of
+    # all_subsets_ols, followed by the given per-alpha columns.
+    coef = coef / scales
+    const = y_mean - coef @ x_means
+    index = pd.Index(alphas, name='alpha')
+    result = pd.DataFrame(columns, index=index)
+    result.columns = pd.MultiIndex.from_product([result.columns, ['']])
+    params = pd.DataFrame(np.column_stack([const, coef]), index=index,
+                          columns=pd.MultiIndex.from_product(
+                              [['params'], ['const'] + x]))
+    return pd.concat([params, result], axis=1)
+
+
+def ridge_path(df, y='Happiness', x=EXPLANATORY_VARS, alphas=None):
+    """
+    Returns the ridge regression of y on the columns x of df for each
+    penalty in alphas (by default 200 values from 1e-3 to 1e5), minimizing
+
+        ||y - b0 - X b||^2 + alpha ||b||^2
+
+    over the rows with no missing values, with the columns of X
+    standardized.  The result is indexed by alpha, with the coefficients
+    (on the original scale of x) under params, the effective degrees of
+    freedom df (the trace of the hat matrix, the intercept included) and
+    the generalized cross-validation score gcv.  result['gcv'].idxmin()
+    is the penalty GCV selects.
+
+    The standardized design is decomposed once as U S V'.  The whole path
+    then follows from the singular values: the coefficients are
+    V diag(s / (s^2 + alpha)) U'y and the residuals shrink each component
+    of U'y by alpha / (s^2 + alpha).
+    """
+    x = list(x)
+    if alphas is None:
+        alphas = np.logspace(-3, 5, 200)
+    alphas = np.asarray(alphas, dtype=np.float64)
+    design, response, x_means, scales, y_mean = _standardized(df, y, x)
+    n = len(response)
+    u, singular, vt = np.linalg.svd(design, full_matrices=False)
+    uty = u.T @ response
+    squares = singular ** 2
+    shrink = squares / (squares[None, :] + alphas[:, None])
+    coef = (shrink / singular * uty) @ vt
+    # The part of y outside the column space of X is never fitted.
+    outside = response @ response - uty @ uty
+    rss = outside + (((1 - shrink) * uty) ** 2).sum(axis=1)
+    dof = 1 + shrink.sum(axis=1)
+    gcv = rss / n / (1 - dof / n) ** 2
+    return _path_frame(alphas, coef, x_means, scales, y_mean, x, df=dof,
+                       gcv=gcv)
+
+
+def elastic_net_path(df, y='Happiness', x=EXPLANATORY_VARS, alphas=None,
+                     l1_ratio=0.5, tol=1e-10, max_iter=10000):
+    """
+    Returns the elastic-net regression of y on the columns x of df for each
+    penalty in alphas (by default 200 values from 1e-4 to 1), minimizing
+
+        ||y - b0 - X b||^2 / (2 n) + alpha l1_ratio |b|_1
+            + alpha (1 - l1_ratio) ||b||^2 / 2
+
+    (the objective of scikit-learn's ElasticNet and of statsmodels'
+    fit_regularized) over the rows with no missing values, with the columns
+    of X standardized.  The result is laid out like ridge_path, with the
+    number of nonzero coefficients nonzero in place of df and gcv.
+
+    Coordinate descent runs on the Gram matrix X'X / n, which is computed
+    once, and updates each coefficient for every penalty at once until no
+    coefficient moves by more than tol.  A RuntimeWarning names the
+    penalties for which that has not happened after max_iter passes.
+    """
+    x = list(x)
+    if alphas is None:
+        alphas = np.logspace(-4, 0, 200)
+    alphas = np.asarray(alphas, dtype=np.float64)
+    design, response, x_means, scales, y_mean = _standardized(df, y, x)
+    n = len(response)
+    gram = design.T @ design / n
+    xty = design.T @ response / n
+    l1 = alphas * l1_ratio
+    l2 = alphas * (1 - l1_ratio)
+    coef = np.zeros((len(alphas), len(x)))
+    for _ in range(max_iter):
+        # The largest move of a coefficient for each penalty.
+        largest = np.zeros(len(alphas))
+        for j in range(len(x)):
+            partial = xty[j] - coef @ gram[j] + gram[j, j] * coef[:, j]
+            updated = np.sign(partial) * np.maximum(np.abs(partial) - l1,
+                                                    0) / (gram[j, j] + l2)
+            np.maximum(largest, np.abs(updated - coef[:, j]), out=largest)
+            coef[:, j] = updated
+        if (largest <= tol).all():
+            break
+    else:
+        warnings.warn('coordinate descent did not converge in {} iterations '
+                      'for alpha = {}; increase max_iter or tol'.format(
+                          max_iter, ', '.join('{:g}'.format(alpha) for alpha
+                                              in alphas[largest > tol])),
+                      RuntimeWarning, stacklevel=2)
+    return _path_frame(alphas, coef, x_means, scales, y_mean, x,
+                       nonzero=(coef != 0).sum(axis=1))
+
+
+def _demean(values, groups, tol=1e-12, max_iter=1000):
+    """
+    Returns the columns of values less their means within each grouping of
+    the rows in groups (a list of arrays of group codes).  With more than
+    one grouping the means are subtracted in turn until they vanish, which
+    projects the columns off all the groupings' dummies at once even when
+    the panel is unbalanced.
+    """
+    counts = [np.bincount(codes) for codes in groups]
+    scale = np.abs(values).max(axis=0) + 1
+    for _ in range(max_iter if len(groups) > 1 else 1):
+        largest = 0.0
+        for codes, count in zip(groups, counts):
+            means = np.column_stack([
+                np.bincount(codes, column, minlength=len(count))
+                for column in values.T]) / count[:, None]
+            values = values - means[codes]
+            largest = max(largest, (np.abs(means) / scale).max())
+        if largest <= tol:
+            break
+    return values
+
+
+def fixed_effects_ols(df, y='Happiness', x=EXPLANATORY_VARS,
+                      entity='country', time=None, cluster=None):
+    """
+    Returns the fixed-effects regression of y on the columns x of df, with
+    an effect for each value of entity (and of time, if given), over the
+    rows with no missing values.  The coefficients equal those of x in
+
+        sm.OLS(df[y], sm.add_constant(pd.concat(
+            [df[x], pd.get_dummies(df[entity], drop_first=True)], axis=1)))
+
+    and the standard errors those of .fit(cov_type='cluster',
+    cov_kwds={'groups': codes of cluster}), clustered by cluster (entity by
+    default).  The result has one row per column of x with the columns
+    coef, bse, z and pvalue.
+
+    No dummy matrix is formed: y and x are demeaned within each entity (and
+    time period) with segmented sums, and the slopes are those of the
+    demeaned data without a constant.  A ValueError names the columns of x
+    that do not vary within the effects, whose coefficients the dummy
+    regression could not identify either.
+    """
+    from scipy.special import ndtr
+
+    x = list(x)
+    cluster = entity if cluster is None else cluster
+    keys = [entity] + ([time] if time is not None else [])
+    values = df[x + [y]].to_numpy(dtype=np.float64)
+    codes = [pd.factorize(df[key])[0] for key in keys + [cluster]]
+    keep = ~np.isnan(values).any(axis=1)
+    for code in codes:
+        keep &= code >= 0
+    codes = [pd.factorize(code[keep])[0] for code in codes]
+    before = np.linalg.norm(values[keep, :-1], axis=0)
+    values = _demean(values[keep], codes[:-1])
+
+    design, response = values[:, :-1], values[:, -1]
+    # A column that does not vary within the effects is left as rounding
+    # noise by the demeaning, and its coefficient cannot be identified.
+    absorbed = np.linalg.norm(design, axis=0) <= 1e-8 * before
+    if absorbed.any():
+        raise ValueError('columns absorbed by the fixed effects: {}'.format(
+            ', '.join(np.array(x)[absorbed])))
+    if np.linalg.matrix_rank(design) < len(x):
+        raise ValueError('the columns are collinear within the fixed '
+                         'effects')
+    nobs = len(response)
+    # The dummy regression has a constant and one coefficient per level of
+    # each effect but the first.
+    n_params = len(x) + 1 + sum(code.max() for code in codes[:-1])
+    inverse = np.linalg.inv(design.T @ design)
+    coef = inverse @ (design.T @ response)
+    residuals = response - design @ coef
+
+    clusters = codes[-1]
+    n_clusters = clusters.max() + 1
+    scores = np.column_stack([
+        np.bincount(clusters, column * residuals, minlength=n_clusters)
+        for column in design.T])
+    correction = n_clusters / (n_clusters - 1) * (nobs - 1) / \
+        (nobs - n_params)
+    cov = inverse @ (scores.T @ scores) @ inverse * correction
+    bse = np.sqrt(np.diag(cov))
+    return pd.DataFrame({'coef': coef, 'bse': bse, 'z': coef / bse,
+                         'pvalue': 2 * ndtr(-np.abs(coef / bse))},
+                        index=pd.Index(x))
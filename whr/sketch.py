@@ -0,0 +1,131 @@
+"""
+Mergeable quantile sketches.
+
+Exact quantiles need the whole column to be sorted, which is the expensive
+part of describe() on large data and impossible when the data is streamed.
+KLLSketch implements the KLL sketch of Karnin, Lang and Liberty: it keeps a
+small number of sampled values at levels of increasing weight and answers
+quantile queries with a bounded error in rank.  Sketches built from
+separate chunks or processes can be merged into one.
+"""
+
+import numpy as np
+
+
+# Apache DataSketches' empirical fit of the KLL rank error (at 99%
+# confidence, for a single quantile) as a function of the parameter k.
+_ERROR_SCALE = 2.296
+_ERROR_EXPONENT = 0.9723
+
+
+def _percentile_label(q):
+    # The labels describe() uses, such as '25%'.
+    return '{:g}%'.format(100 * q)
+
+
+class KLLSketch:
+    """
+    A KLL quantile sketch with accuracy parameter k: larger values of k
+    give smaller errors and keep more values (about 3k in total).
+    """
+
+    def __init__(self, k=200, seed=None):
+        self.k = int(k)
+        self.n = 0
+        self.min = np.inf
+        self.max = -np.inf
+        # Values at level h stand for 2 ** h values of the input.
+        self.levels = [np.empty(0)]
+        self._rng = np.random.default_rng(seed)
+
+    @classmethod
+    def from_error(cls, error, seed=None):
+        """
+        Returns an empty sketch whose quantiles are within error (as a
+        fraction of the number of values) of the exact rank.
+        """
+        k = (_ERROR_SCALE / error) ** (1 / _ERROR_EXPONENT)
+        return cls(max(int(np.ceil(k)), 8), seed)
+
+    @property
+    def error(self):
+        """
+        The rank error of the quantiles, as a fraction of the number of
+        values summarized.  It is zero while every value is still kept.
+        """
+        if len(self.levels) == 1:
+            return 0.0
+        return _ERROR_SCALE / self.k ** _ERROR_EXPONENT
+
+    def _capacity(self, level):
+        depth = len(self.levels) - level - 1
+        return max(2, int(np.ceil(self.k * (2 / 3) ** depth)))
+
+    def _compress(self):
+        while sum(len(items) for items in self.levels) > \
+                sum(self._capacity(h) for h in range(len(self.levels))):
+            level = next(h for h, items in enumerate(self.levels)
+                         if len(items) > self._capacity(h))
+            if level + 1 == len(self.levels):
+                self.levels.append(np.empty(0))
+            items = np.sort(self.levels[level])
+            # Keep one value back when the count is odd, and promote every
+            # other value of the rest, starting at random, to the next level.
+            keep = items[len(items) - len(items) % 2:]
+            items = items[:len(items) - len(items) % 2]
+            promoted = items[self._rng.integers(2)::2]
+            self.levels[level] = keep
+            self.levels[level + 1] = np.concatenate([self.levels[level + 1],
+                                                     promoted])
+
+    def update(self, values):
+        """
+        Adds the values (an array, NaNs are ignored) to the sketch.
+        """
+        values = np.asarray(values, dtype=np.float64).ravel()
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return self
+        self.n += len(values)
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self._compress()
+        return self
+
+    def merge(self, other):
+        """
+        Adds the values summarized by the sketch other to this sketch.
+        """
+        self.k = min(self.k, other.k)
+        self.n += other.n
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for h, items in enumerate(other.levels):
+            self.levels[h] = np.concatenate([self.levels[h], items])
+        self._compress()
+        return self
+
+    def quantiles(self, qs):
+        """
+        Returns the quantiles qs (fractions between 0 and 1) of the values
+        summarized.  While every value is still kept these are exact, and
+        interpolated as np.quantile and describe() do.
+        """
+        qs = np.asarray(qs, dtype=np.float64)
+        if self.n == 0:
+            return np.full(qs.shape, np.nan)
+        if len(self.levels) == 1:
+            return np.quantile(self.levels[0], qs)
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(values), 2.0 ** h)
+                                  for h, values in enumerate(self.levels)])
+        order = np.argsort(items, kind='stable')
+        items = items[order]
+        ranks = np.cumsum(weights[order])
+        positions = np.searchsorted(ranks, qs * ranks[-1], side='left')
+        result = items[np.minimum(positions, len(items) - 1)]
+        result = np.where(qs <= 0, self.min, result)
+        return np.where(qs >= 1, self.max, result)
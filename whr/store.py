@@ -0,0 +1,362 @@
+"""
+An on-disk WHR store that new editions of the report can be appended to.
+
+The exercises re-read the 2018 workbook and re-derive everything from it.
+WHRStore keeps the panel on disk (memory-mapped, stored year by year with
+spare room for more years and countries) together with the per-country sums
+and counts behind dfmean.  Ingesting a new edition writes only the
+country-year cells it contains and adjusts the sums and counts for those
+cells, so the cost of adding a year depends on the size of the new data
+rather than on the length of the history.  The Dystopia benchmark only
+depends on the latest few years, and is recomputed from those years alone.
+
+dystopia_benchmarks computes the Dystopia benchmark of a PanelCube for any
+number of windows of years at once, and DystopiaCache remembers the
+benchmarks it has computed for each window and for the few versions of the
+data used most recently.
+"""
+
+import json
+import os
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from .loader import EXPLANATORY_VARS
+from .panel import PanelCube, _positions
+
+
+# Dystopia takes the lowest country average of each indicator, except for
+# those listed here, where lower values are better.
+DYSTOPIA_DIRECTIONS = {'Corruption': 'max'}
+
+
+def _window_labels(windows):
+    return ['{}-{}'.format(start, stop) for start, stop in windows]
+
+
+def _rolling_windows(cube, years):
+    # Every run of years consecutive years in the cube.
+    last = cube.first_year + cube.values.shape[1] - 1
+    return [(start, start + years - 1)
+            for start in range(cube.first_year, last - years + 2)]
+
+
+def dystopia_benchmarks(cube, windows=None, years=3,
+                        directions=DYSTOPIA_DIRECTIONS,
+                        indicators=EXPLANATORY_VARS):
+    """
+    Returns the Dystopia benchmark of the PanelCube cube for each (start,
+    stop) window of years in windows, both years included, as a dataframe
+    with one row per window label (such as '2015-2017') and one column per
+    indicator.  By default the windows are every run of years consecutive
+    years in the cube; the report published in a given year uses the three
+    years before it.
+
+    directions maps an indicator to 'min' or 'max', the country average
+    Dystopia takes for it; indicators not in directions take 'min'.  All
+    windows are computed from running sums of each country's values over
+    the years the windows span, so each window costs one subtraction per
+    country rather than a pass over its rows.
+    """
+    if windows is None:
+        windows = _rolling_windows(cube, years)
+    windows = [(int(start), int(stop)) for start, stop in windows]
+    labels = pd.Index(_window_labels(windows), name='window')
+    if not windows:
+        return pd.DataFrame(index=labels, columns=list(indicators),
+                            dtype=np.float64)
+    steps = [cube.year_slice(start, stop) for start, stop in windows]
+    first = min(step.start for step in steps)
+    last = max(step.stop for step in steps)
+    columns = _positions(indicators, cube.indicator_index)
+    highest = []
+    for name in indicators:
+        direction = directions.get(name, 'min')
+        if direction not in ('min', 'max'):
+            raise ValueError('unknown direction for {}: {}'.format(
+                name, direction))
+        highest.append(direction == 'max')
+    highest = np.array(highest)
+    # values[y, k, c] is indicator k of country c in year y, so that the
+    # running sums over years and the reductions over countries are both
+    # taken along contiguous rows.
+    values = cube.values[:, first:last][:, :, columns].transpose(1, 2, 0)
+    values = np.array(values, dtype=np.float64, order='C')
+    missing = np.isnan(values)
+    values[missing] = 0
+    sums = np.zeros((len(values) + 1,) + values.shape[1:])
+    counts = np.zeros_like(sums)
+    for y in range(len(values)):
+        np.add(sums[y], values[y], out=sums[y + 1])
+        np.subtract(counts[y] + 1, missing[y], out=counts[y + 1])
+    dystopia = np.empty((len(windows), len(indicators)))
+    for w, step in enumerate(steps):
+        low = step.start - first
+        high = max(step.stop - first, low)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            # The average of each indicator for each country over the window.
+            means = (sums[high] - sums[low]) / (counts[high] - counts[low])
+        # fmin and fmax skip the countries without data in the window.
+        dystopia[w] = np.where(
+            highest, np.fmax.reduce(means, axis=1, initial=np.nan),
+            np.fmin.reduce(means, axis=1, initial=np.nan))
+    return pd.DataFrame(dystopia, index=labels, columns=list(indicators))
+
+
+class DystopiaCache:
+    """
+    Remembers the Dystopia benchmarks computed by dystopia_benchmarks with
+    the given directions and indicators, keyed by window and by the version
+    of the cube they were computed from.  A cube whose data changes must
+    change its version (as WHRStore does on every ingest).  The benchmarks
+    of the max_versions versions used most recently are kept, so that
+    switching between a few editions does not recompute them, while those
+    of older versions are forgotten.  Benchmarks of cubes with no version
+    are computed every time.
+    """
+
+    def __init__(self, directions=DYSTOPIA_DIRECTIONS,
+                 indicators=EXPLANATORY_VARS, max_versions=4):
+        self.directions = dict(directions)
+        self.indicators = list(indicators)
+        self.max_versions = max_versions
+        # The benchmarks of each version by window, the version used most
+        # recently last.
+        self._versions = OrderedDict()
+
+    def __len__(self):
+        return sum(len(benchmarks) for benchmarks in self._versions.values())
+
+    def __call__(self, cube, windows=None, years=3):
+        """
+        Returns dystopia_benchmarks(cube, windows, years), computing only the
+        windows that are not already known for cube.version, all in one
+        call.
+        """
+        if cube.version is None:
+            return dystopia_benchmarks(cube, windows, years, self.directions,
+                                       self.indicators)
+        if windows is None:
+            windows = _rolling_windows(cube, years)
+        windows = [(int(start), int(stop)) for start, stop in windows]
+        benchmarks = self._versions.pop(cube.version, {})
+        self._versions[cube.version] = benchmarks
+        while len(self._versions) > self.max_versions:
+            self._versions.popitem(last=False)
+        missing = [window for window in dict.fromkeys(windows)
+                   if window not in benchmarks]
+        if missing:
+            computed = dystopia_benchmarks(cube, missing, years,
+                                           self.directions, self.indicators)
+            for window, row in zip(missing, computed.to_numpy()):
+                benchmarks[window] = row
+        rows = [benchmarks[window] for window in windows]
+        return pd.DataFrame(np.array(rows).reshape(-1, len(self.indicators)),
+                            index=pd.Index(_window_labels(windows),
+                                           name='window'),
+                            columns=self.indicators)
+
+    def clear(self):
+        """
+        Forgets every benchmark computed so far.
+        """
+        self._versions.clear()
+
+
+def _grown(size, needed):
+    # Grow geometrically so that appending editions one at a time only
+    # reallocates a logarithmic number of times.
+    while size < needed:
+        size = max(2 * size, 1)
+    return size
+
+
+class WHRStore:
+    """
+    Opens the store kept in directory, which must have been created with
+    WHRStore.create.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(self._path('meta.json')) as f:
+            meta = json.load(f)
+        with open(self._path('countries.json')) as f:
+            self.countries = json.load(f)
+        self.first_year = meta['first_year']
+        self.n_years = meta['n_years']
+        self.indicators = meta['indicators']
+        self.version = meta['version']
+        self.dystopia_years = meta['dystopia_years']
+        self._values = np.load(self._path('values.npy'), mmap_mode='r+')
+        self._sums = np.load(self._path('sums.npy'))
+        self._counts = np.load(self._path('counts.npy'))
+        self._dystopia = DystopiaCache()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    @classmethod
+    def create(cls, directory, df, dystopia_years=3):
+        """
+        Creates a store in directory holding the long-format dataframe df
+        (as in the exercises, with country and year columns), and returns
+        it.  The Dystopia benchmark is computed over the latest
+        dystopia_years years.
+        """
+        cube = PanelCube.from_frame(df)
+        os.makedirs(directory, exist_ok=True)
+        n_countries, n_years, n_indicators = cube.values.shape
+        # Years are the slowest-varying axis on disk, so that a new edition
+        # is written to one contiguous block.
+        np.save(os.path.join(directory, 'values.npy'),
+                cube.values.transpose(1, 0, 2))
+        present = ~np.isnan(cube.values)
+        np.save(os.path.join(directory, 'sums.npy'),
+                np.where(present, cube.values, 0).sum(axis=1))
+        np.save(os.path.join(directory, 'counts.npy'),
+                present.sum(axis=1))
+        with open(os.path.join(directory, 'countries.json'), 'w') as f:
+            json.dump([str(name) for name in cube.countries], f)
+        meta = {'first_year': cube.first_year, 'n_years': n_years,
+                'indicators': cube.indicators, 'version': 0,
+                'dystopia_years': dystopia_years}
+        with open(os.path.join(directory, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+        return cls(directory)
+
+    @property
+    def cube(self):
+        """
+        The panel as a PanelCube whose values are a view of the store.
+        """
+        values = self._values[:self.n_years, :len(self.countries)]
+        return PanelCube(values.transpose(1, 0, 2), self.countries,
+                         self.first_year, self.indicators, self.version)
+
+    def _reserve(self, n_countries, first_year, last_year):
+        """
+        Makes room in the value array for n_countries countries and the
+        years first_year to last_year, reallocating it if necessary.
+        """
+        capacity_years, capacity_countries, n_indicators = self._values.shape
+        shift = max(self.first_year - first_year, 0)
+        n_years = max(self.first_year + self.n_years, last_year + 1) - \
+            min(self.first_year, first_year)
+        if (shift == 0 and n_countries <= capacity_countries
+                and n_years <= capacity_years):
+            return
+        shape = (_grown(capacity_years, n_years),
+                 _grown(capacity_countries, n_countries), n_indicators)
+        tmp = self._path('values.tmp.npy')
+        values = np.lib.format.open_memmap(tmp, mode='w+',
+                                           dtype=self._values.dtype,
+                                           shape=shape)
+        values[:] = np.nan
+        values[shift:shift + self.n_years, :len(self.countries)] = \
+            self._values[:self.n_years, :len(self.countries)]
+        values.flush()
+        del values
+        self._values = None
+        os.replace(tmp, self._path('values.npy'))
+        self._values = np.load(self._path('values.npy'), mmap_mode='r+')
+        self.first_year -= shift
+        self.n_years += shift
+
+    def ingest(self, df):
+        """
+        Adds the rows of the long-format dataframe df, for instance a new
+        edition of the report, to the store.  Each row replaces the
+        country-year cell it refers to; indicators missing from df count as
+        NaN.  Rows missing their country or year are left out, as
+        df.groupby('country') leaves them out, and an edition with no other
+        rows leaves the store as it is.
+        """
+        df = df[df['country'].notna() & df['year'].notna()]
+        if df.empty:
+            return
+        df = df.drop_duplicates(['country', 'year'], keep='last')
+        countries = df['country'].to_numpy(dtype=object)
+        rows = pd.Index(self.countries).get_indexer(countries)
+        new = list(pd.unique(countries[rows < 0]))
+        years = df['year'].to_numpy(dtype=np.int64)
+        self._reserve(len(self.countries) + len(new), int(years.min()),
+                      int(years.max()))
+        if new:
+            rows[rows < 0] = len(self.countries) + \
+                pd.Index(new).get_indexer(countries[rows < 0])
+            self.countries.extend(new)
+            self._sums = np.concatenate(
+                [self._sums, np.zeros((len(new), len(self.indicators)))])
+            self._counts = np.concatenate(
+                [self._counts, np.zeros((len(new), len(self.indicators)),
+                                        dtype=self._counts.dtype)])
+        self.n_years = max(self.n_years,
+                           int(years.max()) - self.first_year + 1)
+
+        offsets = years - self.first_year
+        columns = [self.indicators.index(name) if name in self.indicators
+                   else None for name in df.columns]
+        values = np.full((len(df), len(self.indicators)), np.nan)
+        for j, k in enumerate(columns):
+            if k is not None:
+                values[:, k] = df.iloc[:, j].to_numpy(dtype=np.float64)
+
+        # Take the replaced cells out of the per-country aggregates and add
+        # the new ones in.
+        old = np.asarray(self._values[offsets, rows], dtype=np.float64)
+        old_present = ~np.isnan(old)
+        new_present = ~np.isnan(values)
+        np.add.at(self._sums, rows, np.where(new_present, values, 0) -
+                  np.where(old_present, old, 0))
+        np.add.at(self._counts, rows,
+                  new_present.astype(self._counts.dtype) - old_present)
+        self._values[offsets, rows] = values
+
+        self.version += 1
+        self._save(countries_changed=bool(new))
+
+    def _write_json(self, name, obj):
+        tmp = self._path(name + '.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(obj, f)
+        os.replace(tmp, self._path(name))
+
+    def _save(self, countries_changed):
+        self._values.flush()
+        np.save(self._path('sums.npy'), self._sums)
+        np.save(self._path('counts.npy'), self._counts)
+        # The country list only changes when new countries are ingested, and
+        # is written before the metadata that refers to it.
+        if countries_changed:
+            self._write_json('countries.json',
+                             [str(name) for name in self.countries])
+        self._write_json('meta.json', {
+            'first_year': self.first_year, 'n_years': self.n_years,
+            'indicators': self.indicators, 'version': self.version,
+            'dystopia_years': self.dystopia_years})
+
+    def dfmean(self):
+        """
+        Returns the mean of every indicator for each country over all years,
+        as df.groupby('country').mean() does in the exercises (without the
+        year column).
+        """
+        n = len(self.countries)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = self._sums[:n] / self._counts[:n]
+        index = pd.Index(self.countries, name='country')
+        return pd.DataFrame(means, index=index,
+                            columns=self.indicators).sort_index()
+
+    def dystopia(self):
+        """
+        Returns the Dystopia benchmark over the latest dystopia_years years:
+        the lowest country average of each explanatory variable, or the
+        highest for those in DYSTOPIA_DIRECTIONS.
+        """
+        last = self.first_year + self.n_years - 1
+        start = max(last - self.dystopia_years + 1, self.first_year)
+        return self._dystopia(self.cube, [(start, last)]).iloc[0].rename(None)
@@ -0,0 +1,285 @@
+"""
+Summary tables of the WHR indicators in the form of Table 4 of Appendix 1 of
+the 2018 World Happiness Report (Mean, Std. Dev., Min., Max. and N for each
+indicator).
+
+produce_summary_table is the summary of the BasicStatistics exercise,
+without the exercise's selection of columns.  produce_summary_tables
+computes the same table for many windows of years at once, and SummaryState
+computes it from data streamed in chunks that never has to fit in memory at
+once.  SummaryState can also report the percentile columns that
+produce_summary_table drops, estimated with mergeable KLL sketches instead
+of by sorting each column.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from .sketch import KLLSketch, _percentile_label
+
+
+COLUMN_RENAMING = {'count': 'N', 'mean': 'Mean', 'std': 'Std. Dev.',
+                   'min': 'Min.', 'max': 'Max.'}
+COLUMN_ORDER = ['Mean', 'Std. Dev.', 'Min.', 'Max.', 'N']
+
+
+def produce_summary_table(df):
+    """
+    Returns a summary dataframe of df in the same form as Table 4, with one
+    row per numeric column of df other than year (the columns describe()
+    summarizes).  Unlike the function of the BasicStatistics exercise, it
+    does not select cols_to_include first, so df should only hold the
+    indicators and year, as load_whr(columns=COLS_TO_INCLUDE,
+    renaming=RENAMING) returns them.
+    """
+    dfsummary = df.drop(columns=['year'])
+    dfsummary = dfsummary.describe().T.drop(columns=['25%', '50%', '75%'])
+    dfsummary = dfsummary.rename(columns=COLUMN_RENAMING)[COLUMN_ORDER]
+    dfsummary['N'] = dfsummary['N'].astype(int)
+    return dfsummary
+
+
+def _indicators(df, exclude=()):
+    # The columns describe() would summarize, apart from exclude (a column
+    # name, such as the year, or a list of them).
+    exclude = [exclude] if np.ndim(exclude) == 0 else list(exclude)
+    return [name for name in df.columns
+            if name not in exclude and pd.api.types.is_numeric_dtype(df[name])
+            and not pd.api.types.is_bool_dtype(df[name])]
+
+
+def _sorted_groups(codes, size):
+    """
+    Returns the order that sorts the rows by their group codes (integers
+    from 0 to size - 1), keeping the rows of each group in order, and the
+    number of rows in each group.
+    """
+    # A stable sort of 16-bit keys is a radix sort, which is linear in the
+    # number of rows.
+    keys = codes.astype(np.uint16) if size <= 2 ** 16 else codes
+    return (np.argsort(keys, kind='stable'),
+            np.bincount(codes, minlength=size))
+
+
+def _year_groups(years):
+    """
+    Returns the order that sorts the rows by year, the distinct years, and
+    the position in the sorted order where each year starts.
+    """
+    first = years.min()
+    order, counts = _sorted_groups(years - first, years.max() - first + 1)
+    present = np.flatnonzero(counts)
+    starts = np.concatenate([[0], np.cumsum(counts[present])[:-1]])
+    return order, present + first, starts
+
+
+def produce_summary_tables(df, windows, year='year'):
+    """
+    Returns the summary tables of df for each (start, stop) window of years
+    in windows, both years included, as a single dataframe indexed by
+    window label (such as '2015-2017') and indicator.
+
+    For each window the rows are the same as produce_summary_table gives for
+    df.loc[(df[year] >= start) & (df[year] <= stop)], but all windows are
+    computed from one grouping of the rows by year: the count, mean, sum of
+    squared deviations, minimum and maximum of every year are merged into
+    the statistics of each window.  An empty df gives an empty table.
+    """
+    columns = _indicators(df, year)
+    if len(df) == 0:
+        index = pd.MultiIndex.from_arrays([[], []], names=['window', None])
+        dfsummary = pd.DataFrame({name: np.empty(0) for name in COLUMN_ORDER},
+                                 index=index)
+        return dfsummary.astype({'N': int})
+    windows = [(int(start), int(stop)) for start, stop in windows]
+    order, years, starts = _year_groups(df[year].to_numpy(dtype=np.int64))
+    ends = np.append(starts[1:], len(order))
+    sizes = (ends - starts)[:, None]
+
+    shape = (len(years), len(columns))
+    counts = np.empty(shape)
+    means = np.empty(shape)
+    squares = np.empty(shape)
+    minima = np.empty(shape)
+    maxima = np.empty(shape)
+    for j, name in enumerate(columns):
+        values = df[name].to_numpy(dtype=np.float64)[order]
+        present = ~np.isnan(values)
+        filled = np.where(present, values, 0)
+        counts[:, j] = np.add.reduceat(present, starts)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means[:, j] = np.add.reduceat(filled, starts) / counts[:, j]
+        deviations = np.where(present, values - np.repeat(means[:, j],
+                                                          sizes[:, 0]), 0)
+        squares[:, j] = np.add.reduceat(deviations ** 2, starts)
+        minima[:, j] = np.minimum.reduceat(np.where(present, values, np.inf),
+                                           starts)
+        maxima[:, j] = np.maximum.reduceat(np.where(present, values,
+                                                    -np.inf), starts)
+
+    # member[w, y] is True when year y falls in window w.
+    bounds = np.array(windows, dtype=np.int64).reshape(-1, 2)
+    member = (years[None, :] >= bounds[:, :1]) & \
+        (years[None, :] <= bounds[:, 1:])
+    weights = member[:, :, None] * counts[None]
+    n = weights.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = (weights * np.nan_to_num(means)[None]).sum(axis=1) / n
+        spread = weights * (np.nan_to_num(means)[None] - mean[:, None]) ** 2
+        m2 = (member[:, :, None] * squares[None]).sum(axis=1) + \
+            spread.sum(axis=1)
+        std = np.sqrt(m2 / (n - 1))
+    std[n < 2] = np.nan
+    low = np.where(member[:, :, None], minima[None], np.inf).min(axis=1)
+    high = np.where(member[:, :, None], maxima[None], -np.inf).max(axis=1)
+    low[n == 0] = np.nan
+    high[n == 0] = np.nan
+
+    labels = ['{}-{}'.format(start, stop) for start, stop in windows]
+    index = pd.MultiIndex.from_product([labels, columns],
+                                       names=['window', None])
+    dfsummary = pd.DataFrame({'Mean': mean.ravel(), 'Std. Dev.': std.ravel(),
+                              'Min.': low.ravel(), 'Max.': high.ravel(),
+                              'N': n.ravel().astype(int)}, index=index)
+    return dfsummary[COLUMN_ORDER]
+
+
+class SummaryState:
+    """
+    The running count, mean, sum of squared deviations from the mean,
+    minimum and maximum of each of the given columns.  A state is updated
+    with one chunk of rows at a time, and states computed separately (for
+    instance by worker processes) can be merged.
+
+    If quantiles is given, for instance (0.25, 0.5, 0.75), a KLLSketch of
+    each column is kept as well, so that those quantiles are reported to
+    within error (a fraction of N) of their exact rank.
+    """
+
+    def __init__(self, columns, quantiles=None, error=0.01, seed=None):
+        self.columns = list(columns)
+        size = len(self.columns)
+        self.count = np.zeros(size)
+        self.mean = np.zeros(size)
+        self.m2 = np.zeros(size)
+        self.min = np.full(size, np.inf)
+        self.max = np.full(size, -np.inf)
+        self.quantiles = list(quantiles or [])
+        self.sketches = []
+        if self.quantiles:
+            seeds = np.random.SeedSequence(seed).spawn(size)
+            self.sketches = [KLLSketch.from_error(error, seed=child)
+                             for child in seeds]
+
+    def _combine(self, count, mean, m2, low, high):
+        # Chan et al.'s pairwise update, which stays accurate however the
+        # rows are split into chunks.
+        total = self.count + count
+        with np.errstate(invalid='ignore', divide='ignore'):
+            delta = mean - self.mean
+            share = np.where(total > 0, count / total, 0)
+            self.mean = self.mean + delta * share
+            self.m2 = self.m2 + m2 + delta ** 2 * self.count * share
+        self.count = total
+        self.min = np.minimum(self.min, low)
+        self.max = np.maximum(self.max, high)
+
+    def update(self, chunk):
+        """
+        Adds the rows of the dataframe chunk, ignoring missing values.
+        """
+        values = chunk[self.columns].to_numpy(dtype=np.float64)
+        present = ~np.isnan(values)
+        count = present.sum(axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(present, values, 0).sum(axis=0) / count
+        mean = np.where(count > 0, mean, 0)
+        m2 = (np.where(present, values - mean, 0) ** 2).sum(axis=0)
+        low = np.where(present, values, np.inf).min(axis=0, initial=np.inf)
+        high = np.where(present, values, -np.inf).max(axis=0,
+                                                      initial=-np.inf)
+        self._combine(count, mean, m2, low, high)
+        for j, sketch in enumerate(self.sketches):
+            sketch.update(values[:, j])
+        return self
+
+    def merge(self, other):
+        """
+        Adds the rows summarized by the state other, which must be over the
+        same columns and quantiles.
+        """
+        if (other.columns != self.columns
+                or other.quantiles != self.quantiles):
+            raise ValueError('cannot merge states over different columns '
+                             'or quantiles')
+        self._combine(other.count, other.mean, other.m2, other.min,
+                      other.max)
+        for sketch, partial in zip(self.sketches, other.sketches):
+            sketch.merge(partial)
+        return self
+
+    def to_table(self):
+        """
+        Returns the summary in the same form as produce_summary_table, with
+        the estimated quantiles placed between Min. and Max. as describe()
+        places them.
+        """
+        count = self.count
+        with np.errstate(invalid='ignore', divide='ignore'):
+            std = np.sqrt(self.m2 / (count - 1))
+        empty = count == 0
+        dfsummary = pd.DataFrame({
+            'Mean': np.where(empty, np.nan, self.mean),
+            'Std. Dev.': np.where(count < 2, np.nan, std),
+            'Min.': np.where(empty, np.nan, self.min),
+            'Max.': np.where(empty, np.nan, self.max),
+            'N': count.astype(int)}, index=self.columns)
+        if not self.quantiles:
+            return dfsummary[COLUMN_ORDER]
+        labels = [_percentile_label(q) for q in self.quantiles]
+        estimates = np.array([sketch.quantiles(self.quantiles)
+                              for sketch in self.sketches])
+        for k, label in enumerate(labels):
+            dfsummary[label] = estimates[:, k]
+        order = COLUMN_ORDER[:3] + labels + COLUMN_ORDER[3:]
+        return dfsummary[order]
+
+
+def summarize_csv(path, columns=None, year='year', chunksize=10**6,
+                  quantiles=None, error=0.01, seed=None, **kwargs):
+    """
+    Returns the SummaryState of the CSV file at path, read chunksize rows at
+    a time.  By default every numeric column except year is summarized.
+    quantiles, error and seed are passed to SummaryState, and further
+    keyword arguments to pd.read_csv.
+    """
+    state = None
+    if columns is not None:
+        state = SummaryState(columns, quantiles, error, seed)
+        kwargs['usecols'] = list(columns)
+    for chunk in pd.read_csv(path, chunksize=chunksize, **kwargs):
+        if state is None:
+            state = SummaryState(_indicators(chunk, year), quantiles, error,
+                                 seed)
+        state.update(chunk)
+    return state
+
+
+def summarize_csvs(paths, columns=None, year='year', chunksize=10**6,
+                   quantiles=None, error=0.01, max_workers=None, **kwargs):
+    """
+    Returns the SummaryState of all the CSV files in paths, which are
+    summarized by summarize_csv in parallel worker processes.  Unless
+    columns is given, the files must all have the same numeric columns.
+    """
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = [pool.submit(summarize_csv, path, columns, year, chunksize,
+                               quantiles, error, seed, **kwargs)
+                   for seed, path in enumerate(paths)]
+        states = [future.result() for future in futures]
+    state = states[0]
+    for other in states[1:]:
+        state.merge(other)
+    return state